@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import unicodedata
+from difflib import SequenceMatcher
+from collections import defaultdict
+
+
+DEFAULT_AIRPORTS_JSON = os.path.join('locations', 'airports.json')
+
+# a country only says which airport is the usual one, a city / district says where the user actually is
+CITY_MATCH_WEIGHT = 1.0
+COUNTRY_MATCH_WEIGHT = 0.9
+# an upper-case code outside an airport context may just be a word ("MOM and DAD", "I CAN"), keep it below
+# PipelineV2's airport_resolution_min_confidence so city aliases or the LLM decide
+BARE_CODE_CONFIDENCE = 0.5
+
+# "from PUS", "flying out of GMP", "(ICN)", "KIX airport"
+AIRPORT_CODE_CONTEXTS = [
+    r'\b(?:from|via|out of|depart(?:ing|ure)?(?: from)?)\s+([A-Z]{3})\b',
+    r'\(([A-Z]{3})\)',
+    r'\b([A-Z]{3})\s+(?:airport|international|intl)\b',
+]
+
+
+def normalize_place(text: str) -> str:
+    # lowercase, accents removed, punctuation to spaces; hangul / kanji are kept as is
+    text = unicodedata.normalize('NFKD', str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', re.sub(r"[^\w]+", ' ', text.lower())).strip()
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    padded = f" {text} "
+    return {padded[idx:idx + n] for idx in range(max(1, len(padded) - n + 1))}
+
+
+class AirportResolver():
+    """
+    Resolves the departure airport from free-text user details without calling the LLM. Every
+    airport comes with city / district / country aliases (locations/airports.json); word n-grams
+    of the text are matched against them exactly, or fuzzily to tolerate typos: a character bigram
+    index narrows down the candidate aliases, which are then scored by edit similarity. resolve
+    returns (IATA code, confidence), or (None, 0.) when nothing matches.
+    """
+    def __init__(self, airports: list[dict], countries: list[dict], min_similarity: float = 0.8, max_ngram_words: int = 4):
+        self.min_similarity = min_similarity
+        self.max_ngram_words = max_ngram_words
+        self.airports = {airport["iata"]: airport for airport in airports}
+
+        self.aliases = dict()   # normalized alias -> (iata, weight)
+        for airport in airports:
+            # iata codes are not aliases ("can", "sin" are words), they are only matched in upper case
+            for alias in [airport["name"], airport["city"]] + list(airport.get("aliases", [])):
+                self.aliases.setdefault(normalize_place(alias), (airport["iata"], CITY_MATCH_WEIGHT))
+        for country in countries:
+            for alias in country["aliases"]:
+                self.aliases.setdefault(normalize_place(alias), (country["iata"], COUNTRY_MATCH_WEIGHT))
+        self.aliases.pop("", None)
+
+        self.ngram_index = defaultdict(set)   # character bigram -> aliases containing it
+        for alias in self.aliases:
+            for ngram in char_ngrams(alias):
+                self.ngram_index[ngram].add(alias)
+
+
+    @classmethod
+    def from_json(cls, json_path: str = DEFAULT_AIRPORTS_JSON, **kwargs):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            json_data = json.load(f)
+        return cls(json_data["airports"], json_data.get("countries", []), **kwargs)
+
+
+    @staticmethod
+    def similarity(phrase: str, alias: str) -> float:
+        return SequenceMatcher(None, phrase, alias).ratio()
+
+
+    def match_phrase(self, phrase: str):
+        # (alias, similarity) of the closest alias to phrase, or (None, 0.)
+        if phrase in self.aliases:
+            return phrase, 1.
+        if len(phrase) < 4:
+            # short words (e.g. "in", "kl") are only matched exactly
+            return None, 0.
+        # candidates share at least half of the phrase's bigrams and have a similar length
+        phrase_ngrams = char_ngrams(phrase)
+        ngram_counts = defaultdict(int)
+        for ngram in phrase_ngrams:
+            for alias in self.ngram_index.get(ngram, ()):
+                ngram_counts[alias] += 1
+        best_alias, best_similarity = None, 0.
+        for alias, count in ngram_counts.items():
+            if 2 * count < len(phrase_ngrams) or abs(len(alias) - len(phrase)) > max(2, len(alias) // 3):
+                continue
+            similarity = self.similarity(phrase, alias)
+            if similarity > best_similarity:
+                best_alias, best_similarity = alias, similarity
+        return best_alias, best_similarity
+
+
+    def resolve(self, text: str):
+        words = normalize_place(text).split(' ')
+        best_iata, best_confidence = None, 0.
+
+        # airport codes are only trusted in an airport context
+        for pattern in AIRPORT_CODE_CONTEXTS:
+            for code in re.findall(pattern, str(text)):
+                if code in self.airports:
+                    return code, 1.
+        for code in re.findall(r'\b[A-Z]{3}\b', str(text)):
+            if code in self.airports:
+                best_iata, best_confidence = code, BARE_CODE_CONFIDENCE
+                break
+
+        for num_words in range(self.max_ngram_words, 0, -1):
+            for idx in range(len(words) - num_words + 1):
+                phrase = " ".join(words[idx:idx + num_words])
+                alias, similarity = self.match_phrase(phrase)
+                if alias is None or similarity < self.min_similarity:
+                    continue
+                iata, weight = self.aliases[alias]
+                if similarity * weight > best_confidence:
+                    best_iata, best_confidence = iata, similarity * weight
+
+        # non-latin aliases are usually followed by particles ("서울에서"), so also look for them inside words
+        if best_confidence < CITY_MATCH_WEIGHT:
+            normalized_text = " ".join(words)
+            for alias, (iata, weight) in self.aliases.items():
+                if not alias.isascii() and alias in normalized_text and weight > best_confidence:
+                    best_iata, best_confidence = iata, weight
+
+        return best_iata, best_confidence
@@ -0,0 +1,115 @@
+import os
+import anyio
+import asyncio
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.middleware.cors import CORSMiddleware
+
+# reuses the pipeline, firebase & llm setup (and route logic) of the flask server
+import server
+
+
+# max number of pipeline runs in flight at once, each one occupies a worker thread while it waits on upstream I/O
+MAX_CONCURRENT_REQUESTS = int(os.getenv("ASGI_MAX_CONCURRENT_REQUESTS", 32))
+
+request_limiter = anyio.CapacityLimiter(MAX_CONCURRENT_REQUESTS)
+
+
+app = FastAPI()
+app.add_middleware(CORSMiddleware, allow_origins=["http://10.168.105.128:5000", "*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.get('/')
+async def home():
+    return 'Hello World'
+
+
+@app.post('/check_init_input')
+async def check_init_input(request: Request):
+    form = await request.form()
+    check_result_dict = await anyio.to_thread.run_sync(server.run_check_init_input, form.get('query'), limiter=request_limiter)
+    return JSONResponse(check_result_dict)
+
+
+@app.post('/generate_trip')
+async def generate_trip(request: Request):
+    form = await request.form()
+    response = await anyio.to_thread.run_sync(
+        server.run_generate_trip, 
+        form.get('query'), 
+        form.get('user_props'), 
+        form.get('mode'), 
+        limiter=request_limiter
+    )
+    return JSONResponse(response)
+
+
+@app.post('/generate_trip/stream')
+async def generate_trip_stream(request: Request):
+    form = await request.form()
+    # the pipeline runs on its own thread for as long as it takes, so it holds a request_limiter slot
+    # until that thread is done (not until the client disconnects); full means 503 instead of an unbounded thread
+    borrower = object()
+    try:
+        request_limiter.acquire_on_behalf_of_nowait(borrower)
+    except anyio.WouldBlock:
+        return JSONResponse({"error": "Too many trip generations in progress, please retry later"}, status_code=503)
+    loop = asyncio.get_running_loop()
+    events = server.stream_generate_trip(
+        form.get('query'), 
+        form.get('user_props'), 
+        form.get('mode'), 
+        on_finish=lambda: loop.call_soon_threadsafe(request_limiter.release_on_behalf_of, borrower)
+    )
+    # the sync generator blocks on the pipeline thread, starlette iterates it in a worker thread
+    return StreamingResponse(
+        events, 
+        media_type='text/event-stream', 
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post('/generate_script')
+async def generate_script(request: Request):
+    form = await request.form()
+    response, status = await anyio.to_thread.run_sync(
+        server.run_generate_script, 
+        form.get('mode'), 
+        form.get('characters_num'), 
+        form.get('cafe_name'), 
+        form.get('cafe_environment'), 
+        limiter=request_limiter
+    )
+    return JSONResponse(response, status_code=status)
+
+
+@app.post('/jobs/generate_trip')
+async def generate_trip_job(request: Request):
+    form = await request.form()
+    response, status = server.submit_generate_trip_job(form.get('query'), form.get('user_props'), form.get('mode'))
+    return JSONResponse(response, status_code=status)
+
+
+@app.post('/jobs/generate_script')
+async def generate_script_job(request: Request):
+    form = await request.form()
+    response, status = server.submit_generate_script_job(
+        form.get('mode'), 
+        form.get('characters_num'), 
+        form.get('cafe_name'), 
+        form.get('cafe_environment')
+    )
+    return JSONResponse(response, status_code=status)
+
+
+@app.get('/jobs/{job_id}')
+async def job_status(job_id: str):
+    response, status = await anyio.to_thread.run_sync(server.get_job_status, job_id)
+    return JSONResponse(response, status_code=status)
+
+
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='127.0.0.1', port=5000)
+    # uvicorn.run(app, host='0.0.0.0', port=5000)
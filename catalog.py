@@ -0,0 +1,72 @@
+import json
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class LocationRecord():
+    # a detailed Places API entry with the fields used by the pipeline already normalized
+    name: str
+    address: str
+    lat: float
+    lng: float
+    rating: str            # "Not Available" if missing
+    num_ratings: int       # 0 if missing
+    opening_hours: tuple   # ('Not Available',) if missing
+    photos: tuple
+    place_id: str
+    url: str               # None if missing
+    website: str           # None if missing
+
+    @classmethod
+    def from_places_dict(cls, name: str, place_dict: dict):
+        opening_hours = place_dict.get("current_opening_hours", {}).get("weekday_text", ['Not Available'])
+        return cls(
+            name=str(name),
+            address=str(place_dict['formatted_address']),
+            lat=float(place_dict['geometry']['location']['lat']),
+            lng=float(place_dict['geometry']['location']['lng']),
+            rating=str(place_dict['rating']) if 'rating' in place_dict else "Not Available",
+            num_ratings=int(place_dict['user_ratings_total']) if 'user_ratings_total' in place_dict else 0,
+            opening_hours=tuple(opening_hours),
+            photos=tuple(place_dict.get("photos", [])),
+            place_id=place_dict['place_id'],
+            url=place_dict.get('url', None),
+            website=place_dict.get('website', None)
+        )
+
+
+class LocationCatalog():
+    """
+    Immutable, compiled view of a *_detailed.json file. Records are looked up by name in O(1), and
+    coordinates are also kept as columnar float64 arrays aligned with the record indices.
+    """
+    def __init__(self, records: list[LocationRecord]):
+        self.records = tuple(records)
+        self.index = {record.name: idx for idx, record in enumerate(self.records)}
+        self.lat = np.array([record.lat for record in self.records], dtype=np.float64)
+        self.lng = np.array([record.lng for record in self.records], dtype=np.float64)
+
+
+    @classmethod
+    def from_json(cls, json_path: str):
+        with open(json_path, 'r') as f:
+            json_data = json.load(f)
+        return cls.from_json_data(json_data)
+
+
+    @classmethod
+    def from_json_data(cls, json_data: dict):
+        return cls([LocationRecord.from_places_dict(name, place_dict) for name, place_dict in json_data.items()])
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+
+    def __getitem__(self, name: str) -> LocationRecord:
+        return self.records[self.index[name]]
@@ -0,0 +1,100 @@
+import re
+import threading
+import numpy as np
+from collections import OrderedDict
+from llama_index.core import Settings
+from upstream import upstream_slot
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', str(text)).strip().lower()
+
+
+class QueryEmbeddingCache():
+    """
+    In-memory LRU cache of query embeddings keyed by normalized text, so identical preference texts
+    never hit the embedding API twice.
+    """
+    def __init__(self, embed_model=None, max_entries: int = 1024):
+        self.embed_model = embed_model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get_embedding(self, text: str) -> list[float]:
+        key = normalize_text(text)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+
+        embed_model = self.embed_model if self.embed_model is not None else Settings.embed_model
+        with upstream_slot("embedding"):
+            embedding = embed_model.get_query_embedding(text)
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return embedding
+
+
+class SemanticRetrievalCache():
+    """
+    Reuses a previous retrieval result when a new query embedding is a near-duplicate (cosine
+    similarity >= similarity_threshold) of a cached one. Embeddings are kept as pre-normalized rows
+    of a fixed size float32 matrix, so a lookup is a single matrix-vector product; the oldest entry
+    is overwritten once max_entries is reached.
+    """
+    def __init__(self, similarity_threshold: float = 0.97, max_entries: int = 256):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None    # allocated on first add, once the embedding size is known
+        self._results = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+    def lookup(self, embedding):
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._size == 0 or self._matrix.shape[1] != vector.shape[0]:
+                self.misses += 1
+                return None
+            similarities = self._matrix[:self._size] @ vector
+            best_idx = int(np.argmax(similarities))
+            if float(similarities[best_idx]) >= self.similarity_threshold:
+                self.hits += 1
+                return self._results[best_idx]
+            self.misses += 1
+            return None
+
+
+    def add(self, embedding, result):
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._results = [None] * self.max_entries
+                self._size = 0
+                self._next = 0
+            self._matrix[self._next] = vector
+            self._results[self._next] = result
+            self._next = (self._next + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
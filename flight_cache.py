@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_FLIGHT_CACHE_DB = os.path.join('cache', 'flights.db')
+
+# search params that identify a google_flights result, departure_token only for return lookups
+FLIGHT_CACHE_KEY_FIELDS = ("departure_id", "arrival_id", "outbound_date", "return_date", "travel_class", "adults", "departure_token")
+
+
+class FlightSearchCache():
+    """
+    Persistent cache of google_flights search results backed by a local SQLite file, keyed by
+    (departure_id, arrival_id, outbound_date, return_date, travel_class, adults) plus the
+    departure_token for return lookups. Fares change quickly, so entries expire after a short ttl
+    and are evicted least-recently-used once max_entries is exceeded.
+    """
+    def __init__(self, db_path: str = DEFAULT_FLIGHT_CACHE_DB, ttl: float = 30 * 60, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # hit/miss counters per kind of search ("outbound" or "return")
+        self.hits = dict()
+        self.misses = dict()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flight_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT,
+                response TEXT,
+                expires_at REAL,
+                last_access REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS flight_cache_last_access ON flight_cache (last_access)")
+        # outbound searches made for users, read by the fare cache warmer
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flight_searches (
+                departure_id TEXT,
+                travel_class TEXT,
+                adults TEXT,
+                outbound_date TEXT,
+                return_date TEXT,
+                requested_at REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS flight_searches_requested_at ON flight_searches (requested_at)")
+        # SerpAPI calls spent by fare cache warmers, shared by every process using this file
+        self._conn.execute("CREATE TABLE IF NOT EXISTS warmer_spend (spent_at REAL, num_calls INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS warmer_spend_spent_at ON warmer_spend (spent_at)")
+        self._conn.commit()
+
+
+    @staticmethod
+    def get_kind(search_params: dict) -> str:
+        return "return" if search_params.get("departure_token") else "outbound"
+
+
+    @staticmethod
+    def make_key(search_params: dict) -> str:
+        key_fields = [str(search_params.get(field, "")) for field in FLIGHT_CACHE_KEY_FIELDS]
+        return hashlib.sha256("\x00".join(key_fields).encode('utf-8')).hexdigest()
+
+
+    def get(self, search_params: dict):
+        key = self.make_key(search_params)
+        kind = self.get_kind(search_params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, expires_at FROM flight_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM flight_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self._conn.execute("UPDATE flight_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+
+    def expires_in(self, search_params: dict):
+        # secs until the entry expires, None if missing; does not count as a hit or miss
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at FROM flight_cache WHERE key = ?", (self.make_key(search_params),)).fetchone()
+        return None if row is None else row[0] - time.time()
+
+
+    def reserve_warmer_calls(self, num_calls: int, daily_budget: int, window: float = 24 * 60 * 60) -> int:
+        # grants up to num_calls within daily_budget calls per rolling window, across all processes; returns the calls granted
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")   # serializes concurrent reservations from other processes
+            try:
+                spent = self._conn.execute("SELECT COALESCE(SUM(num_calls), 0) FROM warmer_spend WHERE spent_at >= ?", (now - window,)).fetchone()[0]
+                granted = max(0, min(num_calls, daily_budget - spent))
+                if granted > 0:
+                    self._conn.execute("INSERT INTO warmer_spend (spent_at, num_calls) VALUES (?, ?)", (now, granted))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return granted
+
+
+    def set(self, search_params: dict, response: dict, ttl: float = None):
+        key = self.make_key(search_params)
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO flight_cache (key, kind, response, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, self.get_kind(search_params), json.dumps(response), now + ttl, now)
+            )
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM flight_cache").fetchone()[0]
+            if num_entries > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM flight_cache WHERE key IN (SELECT key FROM flight_cache ORDER BY last_access ASC LIMIT ?)",
+                    (num_entries - self.max_entries,)
+                )
+            self._conn.commit()
+
+
+    def log_search(self, search_params: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO flight_searches (departure_id, travel_class, adults, outbound_date, return_date, requested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                tuple(str(search_params.get(field, "")) for field in ("departure_id", "travel_class", "adults", "outbound_date", "return_date")) + (time.time(),)
+            )
+            self._conn.commit()
+
+
+    def top_searches(self, since: float, limit: int = 5) -> list[dict]:
+        # most requested (departure_id, travel_class, adults) since the given timestamp, with their average trip length
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT departure_id, travel_class, adults, COUNT(*) AS num_requests,
+                       AVG(julianday(return_date) - julianday(outbound_date)) AS avg_nights
+                FROM flight_searches WHERE requested_at >= ?
+                GROUP BY departure_id, travel_class, adults
+                ORDER BY num_requests DESC LIMIT ?
+                """,
+                (since, limit)
+            ).fetchall()
+        return [
+            {"departure_id": departure_id, "travel_class": travel_class, "adults": adults, "num_requests": num_requests, "avg_nights": avg_nights}
+            for departure_id, travel_class, adults, num_requests, avg_nights in rows
+        ]
+
+
+    def purge_expired(self, search_log_ttl: float = 30 * 24 * 60 * 60):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM flight_cache WHERE expires_at < ?", (now,))
+            self._conn.execute("DELETE FROM flight_searches WHERE requested_at < ?", (now - search_log_ttl,))
+            self._conn.execute("DELETE FROM warmer_spend WHERE spent_at < ?", (now - 24 * 60 * 60,))
+            self._conn.commit()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM flight_cache").fetchone()[0]
+        total_hits = sum(self.hits.values())
+        total_misses = sum(self.misses.values())
+        return {
+            "entries": num_entries,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_rate": total_hits / (total_hits + total_misses) if (total_hits + total_misses) > 0 else 0.,
+            "per_kind": {
+                kind: {"hits": self.hits.get(kind, 0), "misses": self.misses.get(kind, 0)}
+                for kind in set(self.hits.keys()) | set(self.misses.keys())
+            }
+        }
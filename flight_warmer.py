@@ -0,0 +1,160 @@
+import time
+import threading
+from datetime import datetime, timedelta
+from flight_cache import FlightSearchCache
+
+
+class FareCacheWarmer():
+    """
+    Keeps the flight cache warm for the most requested origins, so the first user on a popular route
+    and date pair does not pay the SerpAPI latency inside get_flights. initial_delay seconds after
+    start, and then every interval seconds, a daemon thread takes the top num_origins (departure,
+    class, party size) combinations searched in the last log_window seconds and refreshes their
+    round trips for the next horizon_days departure dates, nearest dates first. Routes whose cached
+    entry still outlives the next run by refresh_margin are skipped. Every SerpAPI call is reserved
+    from daily_budget, a rolling 24h budget kept in the cache file and shared by all processes, and
+    a single run spends at most budget calls. Warmed entries get the cache's own ttl, so a warmed
+    fare is never served staler than a searched one; interval defaults to that ttl, so a popular
+    route is refreshed as its entry expires (a longer interval leaves gaps between runs).
+    """
+    def __init__(
+        self,
+        pipeline,
+        flight_cache: FlightSearchCache,
+        interval: float = None,             # secs between runs, defaults to flight_cache.ttl
+        budget: int = 40,                   # max SerpAPI calls per run, 0 to disable
+        daily_budget: int = 160,            # max SerpAPI calls per rolling 24h over all processes, 0 to disable
+        initial_delay: float = 10 * 60,     # secs before the first run, so restarts do not trigger a run each
+        refresh_margin: float = 15 * 60,    # secs of ttl beyond the next run below which an entry is refreshed
+        num_origins: int = 3,
+        log_window: float = 7 * 24 * 60 * 60,
+        horizon_days: int = 14,
+        lead_days: int = 1,
+        default_nights: int = 4             # return - outbound date when the logs have no better estimate
+        ):
+        self.pipeline = pipeline
+        self.flight_cache = flight_cache
+        self.interval = interval if interval is not None else flight_cache.ttl
+        self.budget = budget
+        self.daily_budget = daily_budget
+        self.initial_delay = initial_delay
+        self.refresh_margin = refresh_margin
+        self.num_origins = num_origins
+        self.log_window = log_window
+        self.horizon_days = horizon_days
+        self.lead_days = lead_days
+        self.default_nights = default_nights
+        self.entry_ttl = flight_cache.ttl
+        self.last_run = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+
+    def date_pairs(self, nights: int, today: datetime = None) -> list[tuple]:
+        today = today or datetime.now()
+        pairs = []
+        for offset in range(self.lead_days, self.lead_days + self.horizon_days):
+            outbound_date = today + timedelta(days=offset)
+            return_date = outbound_date + timedelta(days=max(1, nights))
+            pairs.append((outbound_date.strftime("%Y-%m-%d"), return_date.strftime("%Y-%m-%d")))
+        return pairs
+
+
+    def reserve_call(self) -> bool:
+        return self.flight_cache.reserve_warmer_calls(1, self.daily_budget) == 1
+
+
+    def needs_refresh(self, search_params: dict) -> bool:
+        expires_in = self.flight_cache.expires_in(search_params)
+        return expires_in is None or expires_in < self.interval + self.refresh_margin
+
+
+    def warm_route(self, search_params: dict, budget: int) -> int:
+        # refreshes one round trip (outbound search, then return lookups until one has a return flight), returns the calls spent
+        if budget <= 0 or not self.reserve_call():
+            return 0
+        flights_dict = self.pipeline.search_flights(search_params, use_cache=False, cache_ttl=self.entry_ttl)
+        num_calls = 1
+        if flights_dict is None:
+            return num_calls
+
+        departure_flights = list(flights_dict.get("best_flights", [])) + list(flights_dict.get("other_flights", []))
+        for departure_flight_dict in departure_flights:
+            if num_calls >= budget:
+                break
+            if "departure_token" not in departure_flight_dict:
+                continue
+            if not self.reserve_call():
+                break
+            search_return_params = dict(search_params, departure_token=departure_flight_dict["departure_token"])
+            return_flights_dict = self.pipeline.search_flights(search_return_params, use_cache=False, cache_ttl=self.entry_ttl)
+            num_calls += 1
+            if self.pipeline.pick_return_flight(return_flights_dict) is not None:
+                break
+        return num_calls
+
+
+    def run_once(self) -> dict:
+        start_time = time.time()
+        self.flight_cache.purge_expired()
+        origins = self.flight_cache.top_searches(since=start_time - self.log_window, limit=self.num_origins)
+
+        # nearest dates first, every origin gets its turn on a date before moving on to the next one
+        routes = []
+        for origin in origins:
+            nights = round(origin["avg_nights"]) if origin["avg_nights"] else self.default_nights
+            routes.append([
+                self.pipeline.build_flight_search_params(origin["departure_id"], outbound_date, return_date, origin["travel_class"], origin["adults"])
+                for outbound_date, return_date in self.date_pairs(nights)
+            ])
+
+        num_calls, num_warmed, num_fresh, out_of_budget = 0, 0, 0, False
+        for date_idx in range(self.horizon_days):
+            for route in routes:
+                if num_calls >= self.budget or out_of_budget:
+                    break
+                if not self.needs_refresh(route[date_idx]):
+                    num_fresh += 1
+                    continue
+                route_calls = self.warm_route(route[date_idx], self.budget - num_calls)
+                if route_calls == 0:
+                    # daily budget used up (possibly by another process)
+                    out_of_budget = True
+                    break
+                num_calls += route_calls
+                num_warmed += 1
+
+        self.last_run = {
+            "origins": [origin["departure_id"] for origin in origins],
+            "warmed": num_warmed,
+            "skipped_fresh": num_fresh,
+            "serpapi_calls": num_calls,
+            "daily_budget_exhausted": out_of_budget,
+            "secs": time.time() - start_time
+        }
+        print(f"[Fare Cache Warmer] {self.last_run}")
+        return self.last_run
+
+
+    def _loop(self):
+        if self._stop_event.wait(self.initial_delay):
+            return
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Fare Cache Warmer] Error: {e}")
+            self._stop_event.wait(self.interval)
+
+
+    def start(self):
+        if self.budget <= 0 or self.daily_budget <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="fare-cache-warmer", daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._stop_event.set()
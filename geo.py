@@ -0,0 +1,35 @@
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_distances(lat: float, lng: float, lats, lngs) -> np.ndarray:
+    # great-circle distances (km) from one point to every point in lats/lngs, in a single vectorized pass
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def nearest_index(lat: float, lng: float, lats, lngs, scores=None) -> int:
+    # index of the closest point, ties broken by the higher score (then by the lower index)
+    distances = haversine_distances(lat, lng, lats, lngs)
+    if scores is None:
+        return int(np.argmin(distances))
+    order = np.lexsort((-np.asarray(scores, dtype=np.float64), distances))
+    return int(order[0])
+
+
+def farthest_index(lat: float, lng: float, lats, lngs) -> int:
+    return int(np.argmax(haversine_distances(lat, lng, lats, lngs)))
+
+
+def pairwise_haversine_distances(lats, lngs) -> np.ndarray:
+    # full n x n great-circle distance matrix (km), meant to be computed once for a fixed catalog
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    delta_lat = lats[:, None] - lats[None, :]
+    delta_lng = lngs[:, None] - lngs[None, :]
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lats)[:, None] * np.cos(lats)[None, :] * np.sin(delta_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
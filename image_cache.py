@@ -0,0 +1,88 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+
+DEFAULT_IMAGE_URL_CACHE_DB = os.path.join('cache', 'image_urls.db')
+
+
+def normalize_keyword(keyword: str) -> str:
+    return re.sub(r'\s+', ' ', str(keyword)).strip().lower()
+
+
+class ImageURLCache():
+    """
+    Persistent keyword -> image url cache backed by a local SQLite file. Entries expire after ttl
+    seconds and are evicted least-recently-used once max_entries is exceeded. An empty url is a
+    valid entry (the search had no results) and is cached as well.
+    """
+    def __init__(self, db_path: str = DEFAULT_IMAGE_URL_CACHE_DB, ttl: float = 7 * 24 * 60 * 60, max_entries: int = 20000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS image_urls (
+                keyword TEXT PRIMARY KEY,
+                url TEXT,
+                expires_at REAL,
+                last_access REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS image_urls_last_access ON image_urls (last_access)")
+        self._conn.commit()
+
+
+    def get(self, keyword: str):
+        key = normalize_keyword(keyword)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT url, expires_at FROM image_urls WHERE keyword = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM image_urls WHERE keyword = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE image_urls SET last_access = ? WHERE keyword = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+
+    def set(self, keyword: str, url: str):
+        key = normalize_keyword(keyword)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_urls (keyword, url, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, url, now + self.ttl, now)
+            )
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM image_urls").fetchone()[0]
+            if num_entries > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM image_urls WHERE keyword IN (SELECT keyword FROM image_urls ORDER BY last_access ASC LIMIT ?)",
+                    (num_entries - self.max_entries,)
+                )
+            self._conn.commit()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM image_urls").fetchone()[0]
+        return {
+            "entries": num_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / (self.hits + self.misses) if (self.hits + self.misses) > 0 else 0.
+        }
@@ -1,81 +1,173 @@
 import os
+import re
+import json
+import threading
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from json_repair import repair_json
 from utils import generate_upstage_response
+from upstream import upstream_slot, get_upstream_limit
+from image_cache import ImageURLCache, normalize_keyword
 from dotenv import load_dotenv; load_dotenv()
 
-def parse_chunk_string(input_string: str) -> List[dict]:
-    chunks = [chunk.strip() for chunk in input_string.split(';') if chunk.strip()]
-    parsed_content = []
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+PEXELS_TIMEOUT = 10    # secs
 
-    for chunk in chunks:
-        if '>' in chunk:
-            content, keywords = chunk.split('>')
-            content = content.strip()
-            keywords = keywords.strip()
-            
-            parsed_content.append({
-                "content": content,
-                "keywords": keywords
+# process-wide keep-alive session and keyword -> url cache, created on first use
+_session = None
+_image_url_cache = None
+_pexels_lock = threading.Lock()
+
+
+def get_pexels_session() -> requests.Session:
+    global _session
+    with _pexels_lock:
+        if _session is None:
+            pool_size = get_upstream_limit("pexels")
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _session.headers.update({
+                "Authorization": os.getenv('PEXELS_API_KEY'),
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.82 Safari/537.36",
+                "Referer": "https://www.pexels.com/"
             })
+        return _session
+
 
-    return parsed_content
+def get_image_url_cache() -> ImageURLCache:
+    global _image_url_cache
+    with _pexels_lock:
+        if _image_url_cache is None:
+            _image_url_cache = ImageURLCache()
+        return _image_url_cache
 
-def generate_keyword_from_script(script: str):
+
+DEFAULT_CHUNK_KEYWORD = "island"
+MAX_CHUNK_CHARS = 1200
+
+def split_script_chunks(script: str, max_chunk_chars: int = MAX_CHUNK_CHARS) -> List[dict]:
+    """
+    Splits the script locally into {"start", "end", "content"} chunks, with offsets into script.
+    Consecutive paragraphs are grouped up to max_chunk_chars, a longer paragraph is cut into
+    sentence windows of at most max_chunk_chars.
+    """
+    spans = []   # (start, end) of every paragraph, or sentence window of a long paragraph
+    for paragraph in re.finditer(r'[^\n]+', script):
+        if not paragraph.group().strip():
+            continue
+        if paragraph.end() - paragraph.start() <= max_chunk_chars:
+            spans.append((paragraph.start(), paragraph.end()))
+            continue
+        window_start = paragraph.start()
+        sentence_ends = [paragraph.start() + match.end() for match in re.finditer(r'[.!?]+(\s+|$)', paragraph.group())]
+        for prev_end, sentence_end in zip([None] + sentence_ends, sentence_ends + [paragraph.end()]):
+            if sentence_end - window_start > max_chunk_chars and prev_end is not None and prev_end > window_start:
+                spans.append((window_start, prev_end))
+                window_start = prev_end
+        if window_start < paragraph.end():
+            spans.append((window_start, paragraph.end()))
+
+    chunks = []
+    for start, end in spans:
+        if chunks and end - chunks[-1]["start"] <= max_chunk_chars and '\n' in script[chunks[-1]["end"]:start]:
+            chunks[-1]["end"] = end
+        else:
+            chunks.append({"start": start, "end": end})
+    for chunk in chunks:
+        chunk["content"] = script[chunk["start"]:chunk["end"]].strip()
+    return chunks
+
+def parse_keyword_json(response_str: str) -> dict:
+    response_str = response_str.strip()
+    try:
+        response = json.loads(response_str)
+    except:
+        try:
+            response = json.loads(repair_json(response_str, skip_json_loads=True))
+        except:
+            response = None
+    return response if isinstance(response, dict) else {}
+
+def generate_keyword_from_script(script: str, max_chunk_chars: int = MAX_CHUNK_CHARS) -> List[dict]:
     chunking_keywords_prompt = '''
-You are given a script. You need to chunk the script into different sections and generate one keyword to represent the main highlights of each section. 
-Yuu should generate based on the following guidelines:
-- You should chunk the script into different sections based on the content.
+You are given the numbered sections of a script. You need to generate one keyword to represent the main highlights of each section.
+You should generate based on the following guidelines:
 - The keyword should be representing the main highlights of the section in a general term.
 - Only use GENERAL, NON-specific keywords. For example, use "Ancient city" instead of "Ancient city of Seongju", use "mountain" instead of "Mount Halla". Use "Island" instead of "Jeju Island".
 - Generate only 1 keyword for each section.
-- DO NOT generate any additional explanation for your response.
-- You should include all the original script in the response, with the keyword following each of the chunks after a ">" symbol.
-- Your response should strictly follow the format of the example below.
-<Content of chunk 1> > <Keyword for content of chunk 1>;
-<Content of chunk 2> > <Keyword for content of chunk 2>;
+- DO NOT repeat the sections and DO NOT generate any additional explanation for your response.
+- Your response should be a single JSON object mapping every section number to its keyword, strictly following the format of the example below.
 
 For example,
-Script:
-The murder mystery unfolds in the ancient city of Seongju, located on the outskirts of Jeju Island. This city, once a thriving hub of trade and culture, has fallen into decay, its grand palaces and temples now reclaimed by the surrounding jungle. The city's history is steeped in the legends of the island's guardian spirits, the Dokkaebi, and the mythical sea serpent, the Yeouija. The story begins with the discovery of a murdered body in the heart of the city, near the ruins of the ancient royal palace. The victim, a wealthy merchant named Lee, was known for his ruthless business practices and exploitation of the island's resources. His body is found with a dagger plunged into his heart, adorned with intricate carvings of the Dokkaebi and the Yeouija.
+Sections:
+[0] The murder mystery unfolds in the ancient city of Seongju, located on the outskirts of Jeju Island. This city, once a thriving hub of trade and culture, has fallen into decay, its grand palaces and temples now reclaimed by the surrounding jungle.
+[1] The story begins with the discovery of a murdered body in the heart of the city, near the ruins of the ancient royal palace. His body is found with a dagger plunged into his heart, adorned with intricate carvings of the Dokkaebi and the Yeouija.
 Response:
-The murder mystery unfolds in the ancient city of Seongju, located on the outskirts of Jeju Island. This city, once a thriving hub of trade and culture, has fallen into decay, its grand palaces and temples now reclaimed by the surrounding jungle. The city's history is steeped in the legends of the island's guardian spirits, the Dokkaebi, and the mythical sea serpent, the Yeouija. > ancient city;
-The story begins with the discovery of a murdered body in the heart of the city, near the ruins of the ancient royal palace. The victim, a wealthy merchant named Lee, was known for his ruthless business practices and exploitation of the island's resources. His body is found with a dagger plunged into his heart, adorned with intricate carvings of the Dokkaebi and the Yeouija. > murder;
-Script:
-{script}
+{{"0": "ancient city", "1": "murder"}}
+Sections:
+{sections}
 Response:
-
 '''
-    input_text = chunking_keywords_prompt.format(script=script)
-    response = generate_upstage_response(input_text)
+    chunks = split_script_chunks(script, max_chunk_chars=max_chunk_chars)
+    if len(chunks) == 0:
+        return []
+
+    sections = "\n".join([f"[{idx}] " + re.sub(r'\s+', ' ', chunk["content"]) for idx, chunk in enumerate(chunks)])
+    keywords = parse_keyword_json(generate_upstage_response(chunking_keywords_prompt.format(sections=sections)))
 
-    return parse_chunk_string(response)
+    for idx, chunk in enumerate(chunks):
+        keyword = keywords.get(str(idx), keywords.get(idx))
+        chunk["keywords"] = str(keyword).strip() if keyword and str(keyword).strip() else DEFAULT_CHUNK_KEYWORD
+    return chunks
 
 
 def generate_keyword_image(scripts: List[dict]):
-    img_urls = []
-    for part in scripts:
-        img_urls.append(get_pexel_img(part["keywords"]))
+    img_urls = get_pexel_imgs([part["keywords"] for part in scripts])
 
     return {
         "content": "<image>".join([part["content"] for part in scripts]),
         "images": img_urls
     }
 
+def search_pexel_img(query: str):
+    # a single uncached Pexels search, returns None on request failure so the miss is not cached
+    try:
+        with upstream_slot("pexels"):
+            response = get_pexels_session().get(PEXELS_SEARCH_URL, params={"query": query}, timeout=PEXELS_TIMEOUT)
+        response.raise_for_status()
+        response_json = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"[Pexels] Search for '{query}' failed: {e}")
+        return None
+    photos = response_json.get('photos', []) if response_json else []
+    if len(photos) > 0:
+        return photos[0].get('src', {}).get('original', '')
+    return ''
+
+def get_pexel_imgs(queries: List[str], max_workers: int = 8) -> List[str]:
+    # cached keywords are answered locally, the remaining unique ones are searched concurrently
+    cache = get_image_url_cache()
+    urls, pending = dict(), dict()   # normalized keyword -> url / query to search
+    for query in queries:
+        key = normalize_keyword(query)
+        if key not in urls:
+            urls[key] = cache.get(query)
+            if urls[key] is None:
+                pending[key] = query
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            for key, url in zip(pending.keys(), executor.map(search_pexel_img, pending.values())):
+                if url is not None:
+                    cache.set(pending[key], url)
+                urls[key] = url or ''
+
+    return [urls[normalize_keyword(query)] for query in queries]
+
 def get_pexel_img(query: str):
-    url = f"https://api.pexels.com/v1/search?query={query}"
-    api_key = os.getenv('PEXELS_API_KEY')
-    headers = {
-        "Authorization": api_key,
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.82 Safari/537.36",
-        "Referer": "https://www.pexels.com/"
-    }
-    
-    response = requests.get(url, headers=headers)
-    # print(f"{query}: {response.json()['photos']}")
-    if response.json() and len(response.json().get('photos', [])) > 0:
-        return response.json().get('photos', [])[0].get('src', {}).get('original', {})
-    return '' 
+    return get_pexel_imgs([query])[0]
 
 def get_place_img(title: str):
     place_name = extract_name_from_title(title)
@@ -115,5 +207,73 @@ def add_images_to_script(script: dict):
     
     return script
 
+def get_paragraph_spans(text: str) -> List[tuple]:
+    # (start, end) of every non blank line, the translator keeps these one to one
+    return [match.span() for match in re.finditer(r'[^\n]*\S[^\n]*', text)]
+
+def nearest_sentence_end(text: str, start: int, end: int, target: float) -> int:
+    # offset in text[start:end] right after a sentence end (or at start / end) closest to target
+    offsets = [start, end] + [start + match.end() for match in re.finditer(r'[.!?。]+\s*', text[start:end])]
+    return min(offsets, key=lambda offset: abs(offset - target))
+
+def map_chunks_to_translation(chunks: List[dict], source_text: str, translated_text: str) -> List[str]:
+    """
+    Splits translated_text into as many pieces as there are chunks of source_text. The translator
+    keeps paragraphs one to one, so each chunk boundary is located in its source paragraph and cut
+    at the sentence end closest to the same relative position of the translated paragraph. If the
+    paragraphs do not line up, the relative position in the whole text is used instead.
+    """
+    if len(chunks) == 0:
+        return []
+    if all("end" in chunk for chunk in chunks):
+        # chunks from split_script_chunks carry their offsets into the source
+        boundaries = [chunk["end"] for chunk in chunks[:-1]]
+    else:
+        chunk_lengths = [len(chunk["content"]) for chunk in chunks]
+        total_length = max(1, sum(chunk_lengths))
+        boundaries = [len(source_text) * sum(chunk_lengths[:idx + 1]) / total_length for idx in range(len(chunks) - 1)]
+
+    source_spans = get_paragraph_spans(source_text)
+    translated_spans = get_paragraph_spans(translated_text)
+    cuts = []
+    for boundary in boundaries:
+        if len(source_spans) > 0 and len(source_spans) == len(translated_spans):
+            paragraph_idx = next((idx for idx, (_, end) in enumerate(source_spans) if boundary <= end), len(source_spans) - 1)
+            source_start, source_end = source_spans[paragraph_idx]
+            translated_start, translated_end = translated_spans[paragraph_idx]
+            ratio = min(1., max(0., (boundary - source_start) / max(1, source_end - source_start)))
+        else:
+            translated_start, translated_end = 0, len(translated_text)
+            ratio = boundary / max(1, len(source_text))
+        target = translated_start + ratio * (translated_end - translated_start)
+        cut = nearest_sentence_end(translated_text, translated_start, translated_end, target)
+        cuts.append(max([cut] + cuts))   # keep cuts monotonic
+    cuts = [0] + cuts + [len(translated_text)]
+
+    return [translated_text[start:end].strip() for start, end in zip(cuts[:-1], cuts[1:])]
+
+def generate_script_decoration(script: dict) -> dict:
+    # one keyword pass and one set of image searches, reusable for the script and its translation
+    chunks = generate_keyword_from_script(script['Script Planner'])
+    return {
+        "source": script['Script Planner'],
+        "chunks": chunks,
+        "images": generate_keyword_image(chunks)["images"]
+    }
+
+def apply_script_decoration(decoration: dict, script: dict, translated_script: dict = None):
+    if translated_script is not None:
+        translated_contents = map_chunks_to_translation(decoration["chunks"], decoration["source"], translated_script['Script Planner'])
+        translated_script['Script Planner'] = "<image>".join(translated_contents)
+        translated_script['images'] = list(decoration["images"])
+
+    script['Script Planner'] = "<image>".join([chunk["content"] for chunk in decoration["chunks"]])
+    script['images'] = list(decoration["images"])
+
+    return script, translated_script
+
+def add_images_to_scripts(script: dict, translated_script: dict):
+    return apply_script_decoration(generate_script_decoration(script), script, translated_script)
+
 if __name__ == "__main__":
     print(get_place_img("Jeju"))
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_JOBS_DB = os.path.join('cache', 'jobs.db')
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobManager():
+    """
+    Runs slow generations (trips, scripts) on a bounded worker pool instead of inside the HTTP request.
+    Job state, progress and the final result are kept in a local SQLite file and removed result_ttl
+    seconds after the job finishes. The file may be shared by several worker processes: each process
+    tags its jobs with its own owner id and refreshes their heartbeat every heartbeat_interval
+    seconds, and only unfinished jobs whose heartbeat is older than stale_after seconds (their
+    process died) are marked as failed.
+    """
+    def __init__(
+        self,
+        max_workers: int = 4,
+        result_ttl: float = 60 * 60,
+        db_path: str = DEFAULT_JOBS_DB,
+        heartbeat_interval: float = 30,
+        stale_after: float = 120
+        ):
+        self.result_ttl = result_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.owner_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT,
+                status TEXT,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL,
+                expires_at REAL,
+                owner TEXT,
+                heartbeat REAL
+            )
+            """
+        )
+        # files created before jobs had an owner
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)").fetchall()]
+        for column, column_type in [("owner", "TEXT"), ("heartbeat", "REAL")]:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+        self.fail_stale_jobs()
+
+        self._stop_event = threading.Event()
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self.heartbeat_interval):
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                    (time.time(), self.owner_id, JOB_QUEUED, JOB_RUNNING)
+                )
+                self._conn.commit()
+            self.fail_stale_jobs()
+
+
+    def fail_stale_jobs(self):
+        # queued / running jobs of a process that stopped heartbeating (it died or restarted) will never finish
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, expires_at = ? WHERE status IN (?, ?) AND COALESCE(heartbeat, 0) < ?",
+                (JOB_FAILED, "Server restarted", now + self.result_ttl, JOB_QUEUED, JOB_RUNNING, now - self.stale_after)
+            )
+            self._conn.commit()
+
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields.keys())
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+
+    def submit(self, kind: str, fn, *args, **kwargs) -> str:
+        # fn is called as fn(*args, progress=<callable>, **kwargs) and must return something json serializable
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, progress, result, error, created_at, updated_at, expires_at, owner, heartbeat) VALUES (?, ?, ?, ?, NULL, NULL, ?, ?, NULL, ?, ?)",
+                (job_id, kind, JOB_QUEUED, "queued", now, now, self.owner_id, now)
+            )
+            self._conn.commit()
+
+        def progress(message: str):
+            self._update(job_id, progress=str(message))
+
+        def run():
+            self._update(job_id, status=JOB_RUNNING, progress="started")
+            try:
+                result = fn(*args, progress=progress, **kwargs)
+                self._update(job_id, status=JOB_DONE, progress="done", result=json.dumps(result, ensure_ascii=False), expires_at=time.time() + self.result_ttl)
+            except Exception as e:
+                print(f"[Job {kind} {job_id}] Error: {e}")
+                self._update(job_id, status=JOB_FAILED, error=str(e), expires_at=time.time() + self.result_ttl)
+
+        self.executor.submit(run)
+        return job_id
+
+
+    def get(self, job_id: str):
+        self.purge_expired()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, progress, result, error, created_at, updated_at FROM jobs WHERE id = ?", 
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, progress, result, error, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "progress": progress,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "createdAt": created_at,
+            "updatedAt": updated_at
+        }
@@ -0,0 +1,159 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from llama_index.core import Settings
+from upstream import upstream_slot
+
+
+DEFAULT_LLM_CACHE_DB = os.path.join('cache', 'llm_responses.db')
+
+
+class LLMResponseCache():
+    """
+    Persistent prompt-level cache in front of Settings.llm.complete, backed by a local SQLite file.
+    Entries are keyed by sha256(template id + model name + formatted prompt), expire after a
+    per-template TTL and are evicted least-recently-used once max_entries is exceeded.
+    """
+    def __init__(
+        self,
+        db_path: str = DEFAULT_LLM_CACHE_DB,
+        max_entries: int = 10000,
+        default_ttl: float = 24 * 60 * 60,    # secs
+        template_ttls: dict = None            # template id -> ttl in secs, 0 to disable caching for that template
+        ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.template_ttls = template_ttls or {}
+
+        # hit/miss counters per template id
+        self.hits = dict()
+        self.misses = dict()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                template_id TEXT,
+                response TEXT,
+                expires_at REAL,
+                last_access REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+
+    @staticmethod
+    def get_model_name(llm) -> str:
+        model_name = getattr(llm, "model", None)
+        if model_name is None:
+            try:
+                model_name = llm.metadata.model_name
+            except Exception:
+                model_name = type(llm).__name__
+        return str(model_name)
+
+
+    @staticmethod
+    def make_key(template_id: str, prompt: str, model_name: str) -> str:
+        return hashlib.sha256("\x00".join([str(template_id), str(model_name), str(prompt)]).encode('utf-8')).hexdigest()
+
+
+    def get_ttl(self, template_id: str) -> float:
+        return self.template_ttls.get(template_id, self.default_ttl)
+
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, expires_at = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return response
+
+
+    def set(self, key: str, template_id: str, response: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, template_id, response, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, template_id, response, now + ttl, now)
+            )
+            # lru eviction
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if num_entries > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (num_entries - self.max_entries,)
+                )
+            self._conn.commit()
+
+
+    def complete(self, template_id: str, prompt: str, llm=None, validate=None) -> str:
+        # validate(response) -> bool guards the cache: answers it rejects (or raises on) are returned but never stored
+        llm = llm if llm is not None else Settings.llm
+        ttl = self.get_ttl(template_id)
+        if ttl <= 0:
+            with upstream_slot("llm"):
+                return str(llm.complete(prompt))
+
+        key = self.make_key(template_id, prompt, self.get_model_name(llm))
+        response = self.get(key)
+        if response is not None:
+            self.hits[template_id] = self.hits.get(template_id, 0) + 1
+            return response
+
+        self.misses[template_id] = self.misses.get(template_id, 0) + 1
+        with upstream_slot("llm"):
+            response = str(llm.complete(prompt))
+        if self.is_valid(response, validate):
+            self.set(key, template_id, response, ttl)
+        return response
+
+
+    @staticmethod
+    def is_valid(response: str, validate=None) -> bool:
+        if validate is None:
+            return True
+        try:
+            return bool(validate(response))
+        except Exception:
+            return False
+
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total_hits = sum(self.hits.values())
+        total_misses = sum(self.misses.values())
+        return {
+            "entries": num_entries,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_rate": total_hits / (total_hits + total_misses) if (total_hits + total_misses) > 0 else 0.,
+            "per_template": {
+                template_id: {"hits": self.hits.get(template_id, 0), "misses": self.misses.get(template_id, 0)}
+                for template_id in set(self.hits.keys()) | set(self.misses.keys())
+            }
+        }
@@ -0,0 +1,101 @@
+import os
+import json
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from upstream import upstream_slot
+
+
+MILVUS_EXPORT_LIMIT = 16384   # catalogs are a few hundred locations, well below this
+
+
+def export_milvus_collection(uri: str, dim: int = None):
+    # reads every node and its embedding out of a Milvus (Lite) vector store built by build_locations_index.py
+    from llama_index.vector_stores.milvus import MilvusVectorStore
+
+    vector_store = MilvusVectorStore(uri=uri, dim=dim, overwrite=False)
+    rows = vector_store.client.query(
+        collection_name=vector_store.collection_name,
+        filter="",
+        output_fields=["*"],
+        limit=MILVUS_EXPORT_LIMIT
+    )
+    nodes, embeddings = [], []
+    for row in rows:
+        nodes.append(metadata_dict_to_node(row))
+        embeddings.append(row[vector_store.embedding_field])
+    return nodes, embeddings
+
+
+class NumpyVectorRetriever(BaseRetriever):
+    """
+    Brute-force in-process retriever for small catalogs. All embeddings live in one contiguous matrix
+    with pre-normalized rows, so a query is a single matrix-vector product followed by argpartition.
+    Returns NodeWithScore objects just like the Milvus backed VectorIndexRetriever.
+    """
+    def __init__(self, nodes: list[TextNode], embeddings, similarity_top_k: int = 500, embed_model=None, dtype=np.float32):
+        super().__init__()
+        assert len(nodes) == len(embeddings)
+        self.nodes = list(nodes)
+        self.similarity_top_k = similarity_top_k
+        self.embed_model = embed_model
+        self.dtype = dtype
+
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        if len(self.nodes) > 0:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.
+            matrix = matrix / norms
+        self.matrix = np.ascontiguousarray(matrix.astype(dtype))
+
+
+    @classmethod
+    def from_milvus(cls, uri: str, dim: int = None, similarity_top_k: int = 500, snapshot_path: str = None, embed_model=None, dtype=np.float32):
+        # the first start exports the Milvus store into an .npz snapshot, later starts never open Milvus
+        snapshot_path = snapshot_path or os.path.splitext(uri)[0] + '.npz'
+        if os.path.exists(snapshot_path) and os.path.getmtime(snapshot_path) >= os.path.getmtime(uri):
+            return cls.load(snapshot_path, similarity_top_k=similarity_top_k, embed_model=embed_model, dtype=dtype)
+
+        nodes, embeddings = export_milvus_collection(uri, dim=dim)
+        retriever = cls(nodes, embeddings, similarity_top_k=similarity_top_k, embed_model=embed_model, dtype=dtype)
+        retriever.save(snapshot_path)
+        return retriever
+
+
+    def save(self, path: str):
+        nodes_json = json.dumps([node.to_dict() for node in self.nodes])
+        np.savez(path, embeddings=self.matrix.astype(np.float32), nodes_json=np.array(nodes_json))
+
+
+    @classmethod
+    def load(cls, path: str, similarity_top_k: int = 500, embed_model=None, dtype=np.float32):
+        with np.load(path) as data:
+            embeddings = data['embeddings']
+            nodes = [TextNode.from_dict(node_dict) for node_dict in json.loads(str(data['nodes_json']))]
+        return cls(nodes, embeddings, similarity_top_k=similarity_top_k, embed_model=embed_model, dtype=dtype)
+
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        if len(self.nodes) == 0:
+            return []
+        if query_bundle.embedding is None:
+            embed_model = self.embed_model if self.embed_model is not None else Settings.embed_model
+            with upstream_slot("embedding"):
+                query_bundle.embedding = embed_model.get_query_embedding(query_bundle.query_str)
+
+        query = np.asarray(query_bundle.embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm > 0:
+            query = query / query_norm
+        scores = (self.matrix @ query.astype(self.dtype)).astype(np.float32)
+
+        top_k = min(self.similarity_top_k, len(self.nodes))
+        if top_k < len(self.nodes):
+            top_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top_indices = np.arange(len(self.nodes))
+        top_indices = top_indices[np.argsort(-scores[top_indices], kind='stable')]
+
+        return [NodeWithScore(node=self.nodes[idx], score=float(scores[idx])) for idx in top_indices]
@@ -1,15 +1,16 @@
 import os
+import re
 import copy
+import threading
 import json
-import math
 import random
 import numpy as np
 from tqdm import tqdm
 from dotenv import load_dotenv
 from serpapi import GoogleSearch
 from sklearn.cluster import DBSCAN
-from geopy.distance import great_circle
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 # https://github.com/mangiucugna/json_repair
 from json_repair import repair_json  # LLM JSON output fixing if necessary
@@ -25,15 +26,42 @@ from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.embeddings.upstage import UpstageEmbedding
 from llama_index.core.tools import QueryEngineTool, ToolMetadata, FunctionTool
 from llama_index.agent.openai import OpenAIAgent
-from llama_index.core.schema import BaseNode
+from llama_index.core.schema import BaseNode, QueryBundle
 
 from google.cloud import firestore
 
+from task_graph import TaskGraph
+from llm_cache import LLMResponseCache
+from flight_cache import FlightSearchCache
+from embedding_cache import QueryEmbeddingCache, SemanticRetrievalCache
+from numpy_retriever import NumpyVectorRetriever
+from catalog import LocationCatalog
+from geo import nearest_index, farthest_index, pairwise_haversine_distances
+from scheduler import TimeSlotScheduler
+from airport_resolver import AirportResolver, BARE_CODE_CONFIDENCE
+from upstream import upstream_slot
+
 
 load_dotenv()
 VERBOSE = False
 CLUSTER_DESTINATION_DISTANCE = 15  # km
 SERPAPI_API_KEY_VAE_NAME = "SERPAPI_API_KEY"
+DEFAULT_DEPARTURE_IATA = "ICN"  # when neither the airport resolver nor the LLM gives a valid code
+
+
+# answer checks for complete_prompt, only answers that pass them are cached
+def is_int_answer(response: str) -> bool:
+    return re.fullmatch(r'-?\d+', str(response).strip()) is not None
+
+def is_date_answer(response: str) -> bool:
+    datetime.strptime(str(response).strip(), '%Y-%m-%d')
+    return True
+
+def is_iata_answer(response: str) -> bool:
+    return re.fullmatch(r'[A-Z]{3}', str(response).strip().upper()) is not None
+
+def is_json_object_answer(response: str) -> bool:
+    return isinstance(json.loads(str(response).strip()), dict)
 
 
 isDestination_check_prompt = PromptTemplate(
@@ -174,6 +202,30 @@ get_ending_date_prompt = PromptTemplate(
     """
 )
 
+query_details_extraction_prompt = PromptTemplate(
+    """
+    You are an information extraction model. Given a user query about generating a trip to Jeju Island, extract all of the fields below in a single pass.
+
+    --Fields--
+    - "isDuration": true if the query contains information about any datetime or duration, otherwise false.
+    - "isBudget": true if the query contains information about budget, otherwise false.
+    - "numPersonsMention": "no" if the query does not mention any number of people involved in the trip, the exact number of people as an integer if it is mentioned, or "yes" if the query mentions a group of people (e.g., "a family," "friends," "team") without an exact number.
+    - "numPersons": the exact number of people as an integer if mentioned (in digit form or written out as words), 3 if only a group of people is mentioned, otherwise 1.
+    - "startDate": the starting date of the trip in the format of YYYY-MM-DD (all numbers), or null if it cannot be determined.
+    - "endDate": the ending date of the trip in the format of YYYY-MM-DD (all numbers), or null if it cannot be determined.
+
+    --Example Input--
+    I wish to visit Jeju Island from 5 - 9 April 2024 with my wife. Can you plan me a trip? I saved up around MYR 5000 for this trip.
+
+    --Corresponding Output--
+    {{"isDuration": true, "isBudget": true, "numPersonsMention": 2, "numPersons": 2, "startDate": "2024-04-05", "endDate": "2024-04-09"}}
+
+    Query: {query_str}
+
+    Output strictly one JSON object with **no additional text**:
+    """
+)
+
 generate_accomodation_preference_prompt = PromptTemplate(
     """
     You are a description generation model that creates detailed accommodation preferences based on user inputs. 
@@ -311,26 +363,45 @@ class PipelineV2():
         accomodations_json: str = os.path.join('locations', 'detailed', 'hotels_detailed.json'),
         restaurants_json: str = os.path.join('locations', 'detailed', 'restaurants_detailed.json'),
         tourist_spots_json: str = os.path.join('locations', 'detailed', 'tourist_spots_detailed.json'),
+        airports_json: str = os.path.join('locations', 'airports.json'),
+        airport_resolution_min_confidence: float = 0.85,  # below this the LLM picks the departure airport
         firestore_db: firestore.Client = None,
-        firestore_db_path: str = None
+        firestore_db_path: str = None,
+        max_concurrent_llm_calls: int = 8,    # 1 to run all LLM calls sequentially
+        flight_search_max_workers: int = 4,   # concurrent return flight lookups per trip
+        max_speculative_flight_searches: int = 8,  # trips whose flight search runs alongside planning
+        flight_cache: FlightSearchCache = None, # persistent google_flights result cache, None to disable
+        batched_query_extraction: bool = True,  # extract all query fields with a single LLM call
+        llm_cache: LLMResponseCache = None,     # persistent prompt-level LLM response cache, None to disable
+        query_embedding_cache_size: int = 1024,
+        retrieval_similarity_threshold: float = None,  # reuse retrieval results of near-duplicate preference texts, None to disable
+        retriever_backend: str = "numpy"        # "numpy" (in-process brute-force) or "milvus"
         ):
-        # accomodations
-        accomodations_vector_store = MilvusVectorStore(uri=accomodations_vec_db_uri, dim=embed_model_size, overwrite=False)
-        accomodations_storage_context = StorageContext.from_defaults(vector_store=accomodations_vector_store)
-        accomodations_index = VectorStoreIndex(nodes=[], storage_context=accomodations_storage_context, embed_model=Settings.embed_model)
-        self.accomodations_retriever = accomodations_index.as_retriever(similarity_top_k=accomodations_sim_top_k)
-        
-        # restaurants
-        restaurants_vector_store = MilvusVectorStore(uri=restaurants_vec_db_uri, dim=embed_model_size, overwrite=False)
-        restaurants_storage_context = StorageContext.from_defaults(vector_store=restaurants_vector_store)
-        restaurants_index = VectorStoreIndex(nodes=[], storage_context=restaurants_storage_context, embed_model=Settings.embed_model)
-        self.restaurants_retriever = restaurants_index.as_retriever(similarity_top_k=restaurants_sim_top_k)
-        
-        # tourist spots
-        tourist_spots_vector_store = MilvusVectorStore(uri=tourist_spots_vec_db_uri, dim=embed_model_size, overwrite=False)
-        tourist_spots_storage_context = StorageContext.from_defaults(vector_store=tourist_spots_vector_store)
-        tourist_spots_index = VectorStoreIndex(nodes=[], storage_context=tourist_spots_storage_context, embed_model=Settings.embed_model)
-        self.tourist_spots_retriever = tourist_spots_index.as_retriever(similarity_top_k=tourist_spots_sim_top_k)
+        if retriever_backend == "numpy":
+            # catalogs are tiny, brute-force search over an in-memory matrix instead of querying Milvus Lite
+            self.accomodations_retriever = NumpyVectorRetriever.from_milvus(uri=accomodations_vec_db_uri, dim=embed_model_size, similarity_top_k=accomodations_sim_top_k, embed_model=Settings.embed_model)
+            self.restaurants_retriever = NumpyVectorRetriever.from_milvus(uri=restaurants_vec_db_uri, dim=embed_model_size, similarity_top_k=restaurants_sim_top_k, embed_model=Settings.embed_model)
+            self.tourist_spots_retriever = NumpyVectorRetriever.from_milvus(uri=tourist_spots_vec_db_uri, dim=embed_model_size, similarity_top_k=tourist_spots_sim_top_k, embed_model=Settings.embed_model)
+        elif retriever_backend == "milvus":
+            # accomodations
+            accomodations_vector_store = MilvusVectorStore(uri=accomodations_vec_db_uri, dim=embed_model_size, overwrite=False)
+            accomodations_storage_context = StorageContext.from_defaults(vector_store=accomodations_vector_store)
+            accomodations_index = VectorStoreIndex(nodes=[], storage_context=accomodations_storage_context, embed_model=Settings.embed_model)
+            self.accomodations_retriever = accomodations_index.as_retriever(similarity_top_k=accomodations_sim_top_k)
+            
+            # restaurants
+            restaurants_vector_store = MilvusVectorStore(uri=restaurants_vec_db_uri, dim=embed_model_size, overwrite=False)
+            restaurants_storage_context = StorageContext.from_defaults(vector_store=restaurants_vector_store)
+            restaurants_index = VectorStoreIndex(nodes=[], storage_context=restaurants_storage_context, embed_model=Settings.embed_model)
+            self.restaurants_retriever = restaurants_index.as_retriever(similarity_top_k=restaurants_sim_top_k)
+            
+            # tourist spots
+            tourist_spots_vector_store = MilvusVectorStore(uri=tourist_spots_vec_db_uri, dim=embed_model_size, overwrite=False)
+            tourist_spots_storage_context = StorageContext.from_defaults(vector_store=tourist_spots_vector_store)
+            tourist_spots_index = VectorStoreIndex(nodes=[], storage_context=tourist_spots_storage_context, embed_model=Settings.embed_model)
+            self.tourist_spots_retriever = tourist_spots_index.as_retriever(similarity_top_k=tourist_spots_sim_top_k)
+        else:
+            raise ValueError(f"Unknown retriever_backend: {retriever_backend}")
         
         # json file paths
         self.accomodations_json = accomodations_json
@@ -343,17 +414,106 @@ class PipelineV2():
         with open(tourist_spots_json, 'r') as f:
             self.tourist_spots_json_data = json.load(f)
         
+        # compiled catalogs, normalized once at startup instead of walking the json on every request
+        self.accomodations_catalog = LocationCatalog.from_json_data(self.accomodations_json_data)
+        self.tourist_spots_catalog = LocationCatalog.from_json_data(self.tourist_spots_json_data)
+        self.tourist_spots_distance_matrix = pairwise_haversine_distances(self.tourist_spots_catalog.lat, self.tourist_spots_catalog.lng)
+        self.airport_resolver = AirportResolver.from_json(airports_json)
+        self.airport_resolution_min_confidence = airport_resolution_min_confidence
+        
         # firestore
         self.firestore_db = firestore_db
         self.firestore_db_path = firestore_db_path
+        
+        # concurrency
+        self.max_concurrent_llm_calls = max_concurrent_llm_calls
+        self.flight_search_max_workers = flight_search_max_workers
+        self.flight_search_executor = ThreadPoolExecutor(max_workers=max(1, max_speculative_flight_searches), thread_name_prefix="flights")
+        self.flight_cache = flight_cache
+        self.batched_query_extraction = batched_query_extraction
+        
+        # llm response cache
+        self.llm_cache = llm_cache
+        
+        # query embedding & near-duplicate retrieval caches
+        self.query_embedding_cache = QueryEmbeddingCache(embed_model=Settings.embed_model, max_entries=query_embedding_cache_size)
+        if retrieval_similarity_threshold is not None:
+            self.accomodations_retrieval_cache = SemanticRetrievalCache(similarity_threshold=retrieval_similarity_threshold)
+            self.tourist_spots_retrieval_cache = SemanticRetrievalCache(similarity_threshold=retrieval_similarity_threshold)
+        else:
+            self.accomodations_retrieval_cache = None
+            self.tourist_spots_retrieval_cache = None
+
+
+    def complete_prompt(self, template_id: str, prompt: str, validate=None) -> str:
+        # template_id is the prompt template's variable name, used as part of the cache key and for per-template TTLs.
+        # validate(response) -> bool keeps malformed answers out of the cache, so a retry asks the LLM again
+        if self.llm_cache is None:
+            with upstream_slot("llm"):
+                return str(Settings.llm.complete(prompt))
+        return self.llm_cache.complete(template_id, prompt, validate=validate)
+
+
+    def extract_query_details(self, query: str) -> dict:
+        # one completion for every field the per-field prompts below would extract
+        response_str = self.complete_prompt("query_details_extraction_prompt", query_details_extraction_prompt.format(query_str=query), validate=is_json_object_answer).strip()
+        
+        response = None
+        try:
+            response = json.loads(response_str)
+        except:
+            try:
+                print(f"[Extract Query Details] Repairing JSON string ...")
+                good_response_str = repair_json(response_str, skip_json_loads=True)
+            except OSError:
+                print(f"[Extract Query Details] Repair failed.")
+                good_response_str = ""
+            if not (str(good_response_str).strip() == ""):
+                try:
+                    response = json.loads(good_response_str)
+                except:
+                    response = None
+        if not isinstance(response, dict):
+            response = {}
+        
+        def to_bool(value):
+            if isinstance(value, bool):
+                return value
+            return str(value).lower().strip() in ["yes", "true", "1"]
+        
+        def to_date(value):
+            try:
+                return datetime.strptime(str(value).strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+            except:
+                return None
+        
+        try:
+            num_persons = max(1, int(response.get("numPersons", 1)))
+        except:
+            num_persons = 1
+        
+        return {
+            "isDuration": to_bool(response.get("isDuration", False)),
+            "isBudget": to_bool(response.get("isBudget", False)),
+            "numPersonsMention": str(response.get("numPersonsMention", "no")).lower().strip(),
+            "numPersons": num_persons,
+            "startDate": to_date(response.get("startDate", None)),
+            "endDate": to_date(response.get("endDate", None))
+        }
 
 
     def check_query_detail(self, query: str):
-        # isDestination    = True if str(Settings.llm.complete(isDestination_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
-        # isInterest       = True if str(Settings.llm.complete(isInterest_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
-        isDuration       = True if str(Settings.llm.complete(isDuration_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
-        isBudget         = True if str(Settings.llm.complete(isBudget_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
-        numPerson_output = str(Settings.llm.complete(numPersons_check_prompt.format(query_str=query))).lower().strip()
+        if self.batched_query_extraction:
+            query_details = self.extract_query_details(query)
+            isDuration = query_details["isDuration"]
+            isBudget = query_details["isBudget"]
+            numPerson_output = query_details["numPersonsMention"]
+        else:
+            # isDestination    = True if str(Settings.llm.complete(isDestination_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
+            # isInterest       = True if str(Settings.llm.complete(isInterest_check_prompt.format(query_str=query))).lower().strip() == "yes" else False
+            isDuration       = True if self.complete_prompt("isDuration_check_prompt", isDuration_check_prompt.format(query_str=query)).lower().strip() == "yes" else False
+            isBudget         = True if self.complete_prompt("isBudget_check_prompt", isBudget_check_prompt.format(query_str=query)).lower().strip() == "yes" else False
+            numPerson_output = self.complete_prompt("numPersons_check_prompt", numPersons_check_prompt.format(query_str=query)).lower().strip()
         # mention group but not number of people
         if "yes" in numPerson_output:
             IsNumPerson = False
@@ -373,14 +533,28 @@ class PipelineV2():
         }
 
 
+    def cached_retrieve(self, retriever, retrieval_cache: SemanticRetrievalCache, text: str) -> list[BaseNode]:
+        # embed once through the cache, then hand the embedding to the retriever so it is not recomputed
+        embedding = self.query_embedding_cache.get_embedding(text)
+        if retrieval_cache is not None:
+            cached_nodes = retrieval_cache.lookup(embedding)
+            if cached_nodes is not None:
+                return cached_nodes
+        
+        nodes = retriever.retrieve(QueryBundle(query_str=text, embedding=embedding))
+        if retrieval_cache is not None:
+            retrieval_cache.add(embedding, nodes)
+        return nodes
+
+
     def get_accomodations_list(self, query: str) -> list[BaseNode]:
         # end_user_specs = 'City Lover, Male, 30, ENTJ, Loves beachball'
         # end_user_specs = "Loves a chill life, doesnt like crowded places, loves coffee, artistic, female, 25, ENTP"
         
         formatted_accomodation_prompt = generate_accomodation_preference_prompt.format(user_query=query)
-        accomodations_preference = Settings.llm.complete(formatted_accomodation_prompt)
+        accomodations_preference = self.complete_prompt("generate_accomodation_preference_prompt", formatted_accomodation_prompt)
         
-        accoms_list = self.accomodations_retriever.retrieve(str(accomodations_preference))
+        accoms_list = self.cached_retrieve(self.accomodations_retriever, self.accomodations_retrieval_cache, accomodations_preference)
         return accoms_list
 
 
@@ -389,9 +563,9 @@ class PipelineV2():
         # end_user_specs = "Loves a chill life, doesnt like crowded places, loves coffee, artistic, female, 25, ENTP"
         
         formatted_destination_prompt = generate_tourist_attraction_preference_prompt.format(user_query=query)
-        destinations_preference = Settings.llm.complete(formatted_destination_prompt)
+        destinations_preference = self.complete_prompt("generate_tourist_attraction_preference_prompt", formatted_destination_prompt)
         
-        destinations_list = self.tourist_spots_retriever.retrieve(str(destinations_preference))
+        destinations_list = self.cached_retrieve(self.tourist_spots_retriever, self.tourist_spots_retrieval_cache, destinations_preference)
         return destinations_list
 
 
@@ -410,22 +584,42 @@ class PipelineV2():
         return dates
 
 
-    def get_flights(self, user_specs, query, outbound_date, return_date):
+    def get_num_person(self, query: str) -> int:
         try:
-            num_person = int(str(Settings.llm.complete(numPersons_extraction.format(query_str=query))))
+            num_person = int(self.complete_prompt("numPersons_extraction", numPersons_extraction.format(query_str=query), validate=is_int_answer))
         except:
             num_person = 1
-        
-        departure_IATA = str(Settings.llm.complete(departure_airport_IATA_extraction.format(user_specs=user_specs))).strip().upper()
-        print(departure_IATA)
-        travel_class = int(str(Settings.llm.complete(flight_class_selection_prompt.format(user_query=query))).strip())
+        return num_person
+
+
+    def get_departure_IATA(self, user_specs: str) -> str:
+        # resolved locally from the airport table, the LLM is only asked when the match is not confident
+        departure_IATA, confidence = self.airport_resolver.resolve(user_specs)
+        if departure_IATA is None or confidence < self.airport_resolution_min_confidence:
+            llm_departure_IATA = self.complete_prompt("departure_airport_IATA_extraction", departure_airport_IATA_extraction.format(user_specs=user_specs), validate=is_iata_answer).strip().upper()
+            if re.fullmatch(r'[A-Z]{3}', llm_departure_IATA):
+                departure_IATA = llm_departure_IATA
+            elif departure_IATA is None or confidence <= BARE_CODE_CONFIDENCE:
+                # a bare upper-case word is not trusted on its own
+                departure_IATA = DEFAULT_DEPARTURE_IATA
+        return departure_IATA
+
+
+    def get_travel_class(self, query: str) -> int:
+        travel_class = int(self.complete_prompt("flight_class_selection_prompt", flight_class_selection_prompt.format(user_query=query), validate=is_int_answer).strip())
         print(travel_class)
-        search_params = {
+        return travel_class
+
+
+    @staticmethod
+    def build_flight_search_params(departure_IATA: str, outbound_date: str, return_date: str, travel_class: int = 1, num_person: int = 1) -> dict:
+        # round trip google_flights search to Jeju, shared with the fare cache warmer so both hit the same cache keys
+        return {
             "api_key": os.getenv(SERPAPI_API_KEY_VAE_NAME),
             "engine": "google_flights",
             "hl": "en",
             "gl": "kr",  # "my"
-            "departure_id": str(departure_IATA),
+            "departure_id": str(departure_IATA).strip().upper(),
             "arrival_id": "CJU",
             "outbound_date": str(outbound_date),
             "return_date": str(return_date),
@@ -446,80 +640,121 @@ class PipelineV2():
             # "infants_on_lap": "0",
             "stops": "0"
         }
+
+
+    def search_flights(self, search_params: dict, use_cache: bool = True, cache_ttl: float = None):
+        # a single google_flights search (through the flight cache if set), None on failure.
+        # use_cache=False always searches, but still stores the fresh result
+        if use_cache and self.flight_cache is not None:
+            flights_dict = self.flight_cache.get(search_params)
+            if flights_dict is not None:
+                return flights_dict
         try:
             search = GoogleSearch(search_params)
-            flights_dict = search.get_dict()
-            print(flights_dict)
+            with upstream_slot("serpapi"):
+                flights_dict = search.get_dict()
         except Exception as e:
             print(f"[Get Flights] Error: {e}")
-            flights_dict = None
+            return None
+        # error responses are not cached, the next trip retries them
+        if self.flight_cache is not None and flights_dict is not None and "error" not in flights_dict:
+            self.flight_cache.set(search_params, flights_dict, ttl=cache_ttl)
+        return flights_dict
+
+
+    @staticmethod
+    def pick_return_flight(return_flights_dict):
+        if return_flights_dict is None:
+            return None
+        if len(return_flights_dict.get("best_flights", [])) > 0:
+            return return_flights_dict["best_flights"][0]
+        if len(return_flights_dict.get("other_flights", [])) > 0:
+            return return_flights_dict["other_flights"][0]
+        return None
+
+
+    def find_return_flight(self, search_params: dict, departure_flights: list, cancel_event: threading.Event = None):
+        """
+        Returns (departure, return) for the best ranked departure candidate that has a return flight,
+        or (None, None). Candidates whose return lookup is already in the flight cache are answered
+        locally; the misses are searched in rank order with at most flight_search_max_workers in
+        flight, and no new lookup is started once a better ranked candidate has succeeded or
+        cancel_event is set.
+        """
+        def get_return_params(departure_flight_dict):
+            search_return_params = copy.deepcopy(search_params)
+            search_return_params["departure_token"] = departure_flight_dict["departure_token"]
+            return search_return_params
+
+        def search_return(departure_flight_dict):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            return self.pick_return_flight(self.search_flights(get_return_params(departure_flight_dict), use_cache=False))
+
+        # idx -> return flight (or None) of the candidates known without calling SerpAPI
+        known_returns, misses = dict(), []
+        for idx, departure_flight_dict in enumerate(departure_flights):
+            if "departure_token" not in departure_flight_dict:
+                known_returns[idx] = None
+                continue
+            cached = self.flight_cache.get(get_return_params(departure_flight_dict)) if self.flight_cache is not None else None
+            if cached is not None:
+                known_returns[idx] = self.pick_return_flight(cached)
+            else:
+                misses.append(idx)
+
+        max_workers = max(1, self.flight_search_max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures, next_miss = dict(), 0
+            for idx, departure_flight_dict in enumerate(departure_flights):
+                if idx in known_returns:
+                    return_flight_dict = known_returns[idx]
+                else:
+                    # keep up to max_workers lookups running ahead of the candidate being consumed
+                    while next_miss < len(misses) and sum(not future.done() for future in futures.values()) < max_workers:
+                        if cancel_event is not None and cancel_event.is_set():
+                            break
+                        futures[misses[next_miss]] = executor.submit(search_return, departure_flights[misses[next_miss]])
+                        next_miss += 1
+                    if idx not in futures:
+                        return None, None   # cancelled
+                    return_flight_dict = futures[idx].result()
+                if return_flight_dict is not None:
+                    return departure_flight_dict, return_flight_dict
+            return None, None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def get_flights(self, user_specs, query, outbound_date, return_date, num_person: int = None, departure_IATA: str = None, travel_class: int = None, cancel_event: threading.Event = None):
+        # flight preferences may be precomputed concurrently by generate_trip, which sets cancel_event if planning fails
+        if num_person is None:
+            num_person = self.get_num_person(query)
+        if departure_IATA is None:
+            departure_IATA = self.get_departure_IATA(user_specs)
+        if travel_class is None:
+            travel_class = self.get_travel_class(query)
+        search_params = self.build_flight_search_params(departure_IATA, outbound_date, return_date, travel_class, num_person)
+        if self.flight_cache is not None:
+            # user searches drive which routes the fare cache warmer keeps fresh
+            self.flight_cache.log_search(search_params)
+        flights_dict = self.search_flights(search_params)
+        if flights_dict is not None:
+            print(flights_dict)
         
         departure_flight_backup = {}   # final resort
         found_departure = False
         found_return = False
         
         if flights_dict is not None:
-            if "best_flights" in list(flights_dict.keys()):
-                departure_flight_backup = copy.deepcopy(flights_dict["best_flights"][0])
-                for idx in range(len(flights_dict["best_flights"])):
-                    departure_flight_dict = flights_dict["best_flights"][idx]
-                    found_departure = True
-                    departure_token = departure_flight_dict["departure_token"]
-                    
-                    # construct search params
-                    search_return_params = copy.deepcopy(search_params)
-                    search_return_params["departure_token"] = departure_token
-                    
-                    # search
-                    try:
-                        search_return = GoogleSearch(search_return_params)
-                        return_flights_dict = search_return.get_dict()
-                    except Exception as e:
-                        print(f"[Get Flights] Error: {e}")
-                        return_flights_dict = None
-                    
-                    # get return flight in obtained return dict
-                    if return_flights_dict is not None:
-                        if "best_flights" in list(return_flights_dict.keys()):
-                            return_flight_dict = return_flights_dict["best_flights"][0]
-                            found_return = True
-                        else:
-                            if "other_flights" in list(return_flights_dict.keys()):
-                                if len(return_flights_dict["other_flights"]) > 0:
-                                    return_flight_dict = return_flights_dict["other_flights"][0]
-                                    found_return = True
-        
-            if ("other_flights" in list(flights_dict.keys())) and (not found_return):
-                if len(flights_dict["other_flights"]) > 0:
-                    if not found_departure:
-                        departure_flight_backup = copy.deepcopy(flights_dict["other_flights"][0])
-                    for idx in range(len(flights_dict["other_flights"])):
-                        departure_flight_dict = flights_dict["other_flights"][idx]
-                        found_departure = True
-                        departure_token = departure_flight_dict["departure_token"]
-                        
-                        # construct search params
-                        search_return_params = copy.deepcopy(search_params)
-                        search_return_params["departure_token"] = departure_token
-                        
-                        # search
-                        try:
-                            search_return = GoogleSearch(search_return_params)
-                            return_flights_dict = search_return.get_dict()
-                        except Exception as e:
-                            print(f"[Get Flights] Error: {e}")
-                            return_flights_dict = None
-                        
-                        # get return flight in obtained return dict
-                        if return_flights_dict is not None:
-                            if "best_flights" in list(return_flights_dict.keys()):
-                                return_flight_dict = return_flights_dict["best_flights"][0]
-                                found_return = True
-                            else:
-                                if "other_flights" in list(return_flights_dict.keys()):
-                                    if len(return_flights_dict["other_flights"]) > 0:
-                                        return_flight_dict = return_flights_dict["other_flights"][0]
-                                        found_return = True
+            # departure candidates in rank order, best flights first
+            departure_flights = list(flights_dict.get("best_flights", [])) + list(flights_dict.get("other_flights", []))
+            if len(departure_flights) > 0:
+                found_departure = True
+                departure_flight_backup = copy.deepcopy(departure_flights[0])
+                departure_flight_dict, return_flight_dict = self.find_return_flight(search_params, departure_flights, cancel_event=cancel_event)
+                found_return = return_flight_dict is not None
         
         # utility to format time from m to h:m
         def convert_duration_to_string(data):
@@ -540,7 +775,9 @@ class PipelineV2():
                     convert_duration_to_string(item)
         print(found_departure, found_return)
         if found_departure and found_return:
-            _ = departure_flight_dict.pop("price")
+            departure_flight_dict = copy.deepcopy(departure_flight_dict)
+            return_flight_dict = copy.deepcopy(return_flight_dict)
+            _ = departure_flight_dict.pop("price", None)
             price_total = return_flight_dict.pop("price")
             
             # convert time format
@@ -574,90 +811,122 @@ class PipelineV2():
 
 
 
-    def generate_trip(self, end_user_specs: str, end_user_query: str):
+    @staticmethod
+    def get_flight_dates(starting_date, ending_date):
+        # fly in the day before the trip starts and back the day after it ends
+        outbound_date = (datetime.strptime(str(starting_date), "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        return_date = (datetime.strptime(str(ending_date), "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        return outbound_date, return_date
+
+
+    def generate_trip(self, end_user_specs: str, end_user_query: str, on_stage=None):
+        # on_stage(stage, payload) is called as each part of the trip is ready, for streaming partial results.
+        # the flight search is started speculatively as soon as the dates are known, and cancelled if planning fails
+        flight_search = {"future": None, "cancel_event": threading.Event()}
+        try:
+            return self.plan_trip(end_user_specs, end_user_query, on_stage, flight_search)
+        except BaseException:
+            flight_search["cancel_event"].set()
+            if flight_search["future"] is not None:
+                flight_search["future"].cancel()
+            raise
+
+
+    def plan_trip(self, end_user_specs: str, end_user_query: str, on_stage, flight_search: dict):
+        emit = on_stage or (lambda stage, payload: None)
         # end_user_specs = "Loves a chill life, doesnt like crowded places, loves coffee, artistic, female, 25, ENTP"
         # end_user_specs = "Nature Lover, Photography, Solo-Traveller"
         # end_user_final_query = "Can you plan me a trip to Jeju Island from 18 January to 20 January in 2025? My budget is around MYR 3000. " + end_user_specs
         # end_user_final_query = "Can you plan me a 3-day trip to Jeju Island starting from 18 January 2025? My budget is around MYR 3000. " + end_user_specs
 
-        starting_date = Settings.llm.complete(get_starting_date_prompt.format(query_str=end_user_query))
-        ending_date = Settings.llm.complete(get_ending_date_prompt.format(query_str=end_user_query))
+        query = f"User Details: {end_user_specs}. \n User Query: {end_user_query}"
+
+        # the LLM calls below depend only on the raw user input, run them concurrently
+        llm_graph = TaskGraph(max_workers=self.max_concurrent_llm_calls)
+        if self.batched_query_extraction:
+            llm_graph.add("query_details", lambda: self.extract_query_details(end_user_query))
+            # fall back to the dedicated prompts only when the batched extraction could not parse a date
+            llm_graph.add("starting_date", lambda query_details: query_details["startDate"] or self.complete_prompt("get_starting_date_prompt", get_starting_date_prompt.format(query_str=end_user_query), validate=is_date_answer), ["query_details"])
+            llm_graph.add("ending_date", lambda query_details: query_details["endDate"] or self.complete_prompt("get_ending_date_prompt", get_ending_date_prompt.format(query_str=end_user_query), validate=is_date_answer), ["query_details"])
+            llm_graph.add("num_person", lambda query_details: query_details["numPersons"], ["query_details"])
+        else:
+            llm_graph.add("starting_date", lambda: self.complete_prompt("get_starting_date_prompt", get_starting_date_prompt.format(query_str=end_user_query), validate=is_date_answer))
+            llm_graph.add("ending_date", lambda: self.complete_prompt("get_ending_date_prompt", get_ending_date_prompt.format(query_str=end_user_query), validate=is_date_answer))
+            llm_graph.add("num_person", lambda: self.get_num_person(end_user_query))
+        llm_graph.add("accomodations_nodelist", lambda: self.get_accomodations_list(query=query))
+        llm_graph.add("destinations_nodelist", lambda: self.get_destinations_list(query=query))
+        llm_graph.add("need_reranking", lambda: self.complete_prompt("tourist_attraction_pipeline_selection_prompt", tourist_attraction_pipeline_selection_prompt.format(user_specs=end_user_specs, user_query=end_user_query), validate=is_int_answer))
+        llm_graph.add("user_time_preference", lambda: self.complete_prompt("generate_user_visiting_times_preferences_prompt", generate_user_visiting_times_preferences_prompt.format(user_specs=end_user_specs, user_query=end_user_query)))
+        llm_graph.add("departure_IATA", lambda: self.get_departure_IATA(end_user_specs))
+        llm_graph.add("travel_class", lambda: self.get_travel_class(end_user_query))
+
+        def start_flight_search(starting_date, ending_date, num_person, departure_IATA, travel_class):
+            # only needs the dates and flight preferences, so it runs in the background while the rest is planned
+            try:
+                outbound_date, return_date = self.get_flight_dates(starting_date, ending_date)
+            except ValueError as e:
+                print(f"[Speculative Flight Search] Not started: {e}")
+                return None
+            flight_search["future"] = self.flight_search_executor.submit(
+                self.get_flights,
+                user_specs=end_user_specs,
+                query=end_user_query,
+                outbound_date=outbound_date,
+                return_date=return_date,
+                num_person=num_person,
+                departure_IATA=departure_IATA,
+                travel_class=travel_class,
+                cancel_event=flight_search["cancel_event"]
+            )
+            return flight_search["future"]
+        llm_graph.add("flight_search", start_flight_search, ["starting_date", "ending_date", "num_person", "departure_IATA", "travel_class"])
+
+        def emit_dates(starting_date, ending_date):
+            # streamed as soon as the dates are parsed, without waiting for retrieval and the other LLM calls
+            dates = self.generate_dates(str(starting_date), str(ending_date))
+            emit("dates", {"startDate": str(starting_date), "endDate": str(ending_date), "dates": dates})
+            return dates
+        llm_graph.add("dates", emit_dates, ["starting_date", "ending_date"])
+        llm_results = llm_graph.run()
+
+        starting_date = llm_results["starting_date"]
+        ending_date = llm_results["ending_date"]
 
         print(starting_date)
         print(ending_date)
 
-        dates = self.generate_dates(str(starting_date), str(ending_date))
+        dates = llm_results["dates"]
         print(dates)
 
-
-        query = f"User Details: {end_user_specs}. \n User Query: {end_user_query}"
-        accomodations_nodelist = self.get_accomodations_list(query=query)
-        destinations_nodelist = self.get_destinations_list(query=query)
+        accomodations_nodelist = llm_results["accomodations_nodelist"]
+        destinations_nodelist = llm_results["destinations_nodelist"]
         
         destinations_list_of_dict = []
         for node in destinations_nodelist:
-            dest_name = str(node.text)
-            price = "Not available"  # TODO: FIX
-            address = str(self.tourist_spots_json_data[dest_name]['formatted_address'])
-            lat = float(self.tourist_spots_json_data[dest_name]['geometry']['location']['lat'])
-            lng = float(self.tourist_spots_json_data[dest_name]['geometry']['location']['lng'])
-            # rating
-            if 'rating' in self.tourist_spots_json_data[dest_name].keys():
-                rating = str(self.tourist_spots_json_data[dest_name]['rating'])
-            else:
-                rating = "Not Available"
-            # num ratings
-            if 'user_ratings_total' in self.tourist_spots_json_data[dest_name].keys():
-                num_ratings = int(self.tourist_spots_json_data[dest_name]['user_ratings_total'])
-            else:
-                num_ratings = 0
-            # opening hours
-            if "current_opening_hours" in self.tourist_spots_json_data[dest_name].keys():
-                if "weekday_text" in self.tourist_spots_json_data[dest_name]["current_opening_hours"].keys():
-                    opening_hours = self.tourist_spots_json_data[dest_name]["current_opening_hours"]["weekday_text"]
-                else:
-                    opening_hours = ['Not Available']
-            else:
-                opening_hours = ['Not Available']
-            # photos
-            if "photos" in self.tourist_spots_json_data[dest_name].keys():
-                photos = self.tourist_spots_json_data[dest_name]["photos"]
-            else:
-                photos = []
-            
-            if 'website' in self.tourist_spots_json_data[dest_name].keys():
-                website = self.tourist_spots_json_data[dest_name]['website']
-            else:
-                website = None
-            
-            if 'url' in self.tourist_spots_json_data[dest_name].keys():
-                url = self.tourist_spots_json_data[dest_name]['url']
-            else:
-                url = None
-            
+            dest = self.tourist_spots_catalog[str(node.text)]
             destinations_list_of_dict.append(
                 {
-                    "Name": dest_name,
+                    "Name": dest.name,
                     "Description": node.metadata['description'],
                     "_suitable_visiting_times": node.metadata['suitable_visiting_times'],  # remove before return
-                    "Price": price,
-                    "Address": address,
-                    "Latitude": lat,
-                    "Longitude": lng,
-                    "Rating": rating,
-                    "NumRating": num_ratings,
-                    "OpeningHours": opening_hours,
-                    "Photos": photos,
-                    "GooglePlaceID": self.tourist_spots_json_data[dest_name]['place_id'],
-                    "GoogleMapsURL": url,
-                    "DestinationWebsiteURL": website,
+                    "Price": "Not available",  # TODO: FIX
+                    "Address": dest.address,
+                    "Latitude": dest.lat,
+                    "Longitude": dest.lng,
+                    "Rating": dest.rating,
+                    "NumRating": dest.num_ratings,
+                    "OpeningHours": list(dest.opening_hours),
+                    "Photos": list(dest.photos),
+                    "GooglePlaceID": dest.place_id,
+                    "GoogleMapsURL": dest.url,
+                    "DestinationWebsiteURL": dest.website,
                     "id": None
                 }
             )
         
         
         # rerank destinations based on both rating & number of ratings, or based on ratings only
-        need_reranking = Settings.llm.complete(tourist_attraction_pipeline_selection_prompt.format(user_specs=end_user_specs, user_query=end_user_query))
+        need_reranking = llm_results["need_reranking"]
         try:
             reranking_mode = int(str(need_reranking))
             print(f"[reranking_mode={reranking_mode}]")
@@ -686,7 +955,7 @@ class PipelineV2():
             destinations_list_of_dict = sorted(destinations_list_of_dict, key=custom_f1, reverse=True)
         
         # TODO: FIX
-        user_time_preference = Settings.llm.complete(generate_user_visiting_times_preferences_prompt.format(user_specs=end_user_specs, user_query=end_user_query))
+        user_time_preference = llm_results["user_time_preference"]
         user_time_preference = str(user_time_preference).strip().lower()
         
         if ("none" in user_time_preference):
@@ -706,25 +975,11 @@ class PipelineV2():
             visiting_times = ['dawn', 'morning', 'afternoon', 'evening', 'night']
             mmgc_visiting_times = ['afternoon', 'evening', 'night']
         
-        # preserve original rank
-        tmp = []
-        for idx, d in enumerate(destinations_list_of_dict):
-            d_ = copy.deepcopy(d)
-            d_['_rank'] = idx
-            tmp.append(d_)
-        destinations_list_of_dict = tmp
-        
-        tmp = []
+        # select enough destinations to fill every visiting time of every day, preserving original rank
         TOTAL_DESTINATIONS = len(dates)*DESTINATIONS_PER_DAY
-        for _ in range(len(dates)):
-            for visiting_time in visiting_times:
-                for i, d in enumerate(destinations_list_of_dict):
-                    if visiting_time in d['_suitable_visiting_times']:
-                        tmp.append(destinations_list_of_dict.pop(i))
-                        break
-        destinations_list_of_dict = sorted(tmp, key=lambda x: x["_rank"])
-        for d in destinations_list_of_dict:
-            d.pop("_rank", None)  # remove _rank
+        rank_scheduler = TimeSlotScheduler([d['_suitable_visiting_times'] for d in destinations_list_of_dict])
+        selected_destinations_idx = sorted(idx for day in rank_scheduler.fill(len(dates), visiting_times) for _, idx in day)
+        destinations_list_of_dict = [destinations_list_of_dict[i] for i in selected_destinations_idx]
 
 
         # DESTINATIONS_PER_DAY = 
@@ -734,15 +989,11 @@ class PipelineV2():
         # else:
         #     destinations_list_of_dict = destinations_list_of_dict[:TOTAL_DESTINATIONS]
         
-        # custom distance function
-        def haversine_distance(coord1, coord2):
-            return great_circle(coord1, coord2).km
-
-        # Perform DBSCAN clustering, eps in km
-        destinations_long_lat = [(i["Latitude"], i["Longitude"]) for i in destinations_list_of_dict]
-        destinations_long_lat_np = np.array(destinations_long_lat)
-        dbscan = DBSCAN(eps=CLUSTER_DESTINATION_DISTANCE, min_samples=1, metric=haversine_distance)
-        clusters = dbscan.fit_predict(destinations_long_lat_np)
+        # Perform DBSCAN clustering, eps in km, on the precomputed catalog distance matrix
+        destinations_idx = np.array([self.tourist_spots_catalog.index[i["Name"]] for i in destinations_list_of_dict], dtype=np.int64)
+        destinations_distance_matrix = self.tourist_spots_distance_matrix[np.ix_(destinations_idx, destinations_idx)]
+        dbscan = DBSCAN(eps=CLUSTER_DESTINATION_DISTANCE, min_samples=1, metric='precomputed')
+        clusters = dbscan.fit_predict(destinations_distance_matrix)
         clusters = clusters.tolist()
         assert len(clusters) == len(destinations_list_of_dict)
 
@@ -755,6 +1006,8 @@ class PipelineV2():
         # order destinations by cluster
         clusters_indices = order_indices_by_values(clusters)
         destinations_list_of_dict = [destinations_list_of_dict[i] for i in clusters_indices]
+        # internal keys (e.g. _suitable_visiting_times) are not part of the response
+        emit("destinations", [{key: value for key, value in dest.items() if not key.startswith('_')} for dest in destinations_list_of_dict])
 
         # # adjust destinations per day accordingly
         # if len(dates) > len(destinations_list_of_dict):
@@ -781,74 +1034,31 @@ class PipelineV2():
                 return (lat/counter, long/counter)
 
 
-        def get_batch_distance(destination_lat, destination_lon, locations_list_of_dict):
-            def haversine(lat1, lon1, lat2, lon2):
-                # convert latitude and longitude from degrees to radians
-                lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-                
-                # haversine
-                delta_lat = lat2 - lat1
-                delta_lon = lon2 - lon1
-                a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(delta_lon / 2) ** 2
-                c = 2 * math.asin(math.sqrt(a))
-                
-                # earth radius in km
-                r = 6371.0
-                distance = r * c
-                return distance
-            
-            return_locations_list_of_dict = []
-            for location_dict in locations_list_of_dict:
-                distances = haversine(destination_lat, destination_lon, location_dict['Latitude'], location_dict['Longitude'])
-                dict_copy = copy.deepcopy(location_dict)
-                dict_copy['_distance_from_target'] = float(distances)
-                return_locations_list_of_dict.append(dict_copy)
-            return return_locations_list_of_dict
-
-
         # form dict with some basic info for accomodatios first
         accomodations_list_of_dict = []
         for node in accomodations_nodelist:
-            accom_name = str(node.text)
-            address = str(self.accomodations_json_data[accom_name]['formatted_address'])
-            lat = float(self.accomodations_json_data[accom_name]['geometry']['location']['lat'])
-            lng = float(self.accomodations_json_data[accom_name]['geometry']['location']['lng'])
-            # rating
-            if 'rating' in self.accomodations_json_data[accom_name].keys():
-                rating = str(self.accomodations_json_data[accom_name]['rating'])
-            else:
-                rating = "Not Available"
-            # num ratings
-            if 'user_ratings_total' in self.accomodations_json_data[accom_name].keys():
-                num_ratings = int(self.accomodations_json_data[accom_name]['user_ratings_total'])
-            else:
-                num_ratings = 0
-            
-            if 'website' in self.accomodations_json_data[accom_name].keys():
-                website = self.accomodations_json_data[accom_name]['website']
-            else:
-                website = None
-            
-            if 'url' in self.accomodations_json_data[accom_name].keys():
-                url = self.accomodations_json_data[accom_name]['url']
-            else:
-                url = None
-
+            accom = self.accomodations_catalog[str(node.text)]
             accomodations_list_of_dict.append(
                 {
-                    "Name": accom_name,
+                    "Name": accom.name,
                     "Description": node.metadata['description'],
                     "_cosine_sim_score": float(node.score),    # remove before returning
-                    "Address": address,
-                    "Latitude": lat,
-                    "Longitude": lng,
-                    "Rating": rating,           # possibly useful for reccomendations
-                    "NumRating": num_ratings,
-                    "GoogleMapsURL": url,
-                    "AccomodationWebsiteURL": website,
+                    "Address": accom.address,
+                    "Latitude": accom.lat,
+                    "Longitude": accom.lng,
+                    "Rating": accom.rating,           # possibly useful for reccomendations
+                    "NumRating": accom.num_ratings,
+                    "GoogleMapsURL": accom.url,
+                    "AccomodationWebsiteURL": accom.website,
                     "id": None
                 }
             )
+        
+        # columnar coordinates & scores for vectorized distance ranking
+        accomodations_idx = np.array([self.accomodations_catalog.index[accom["Name"]] for accom in accomodations_list_of_dict], dtype=np.int64)
+        accomodations_lat = self.accomodations_catalog.lat[accomodations_idx]
+        accomodations_lng = self.accomodations_catalog.lng[accomodations_idx]
+        accomodations_scores = np.array([accom["_cosine_sim_score"] for accom in accomodations_list_of_dict], dtype=np.float64)
 
 
         date_dict = dict()
@@ -856,6 +1066,7 @@ class PipelineV2():
         valid_counter = 0
         
         date_idx_to_add_mmgc = int(random.random() * (len(dates) - 1))
+        day_scheduler = TimeSlotScheduler([d['_suitable_visiting_times'] for d in destinations_list_of_dict])
         
         for idx, date in enumerate(dates):
             current_date_dict = dict()
@@ -869,27 +1080,26 @@ class PipelineV2():
             #     valid_counter += 1
             # current_date_dict['destination'] = current_date_destination_list
             
-            # destinations for one day
+            # destinations for one day, best remaining (cluster ordered) dest suitable for each time of day
             for visiting_time in visiting_times:
-                # search for dest suitable for each time of day
-                for i, d in enumerate(destinations_list_of_dict[:]):
-                    if visiting_time in d['_suitable_visiting_times']:
-                        dest = destinations_list_of_dict.pop(i)
-                        dest.pop('_suitable_visiting_times')
-                        dest['startDate'] = str(date)
-                        dest['endDate'] = str(date)
-                        dest['visitingTime'] = str(visiting_time)
-                        dest['isMurderMysteryCafe'] = False
-                        current_date_destination_list.append(dest)
-                        break
+                i = day_scheduler.take(visiting_time)
+                if i is None:
+                    continue
+                dest = destinations_list_of_dict[i]
+                dest.pop('_suitable_visiting_times')
+                dest['startDate'] = str(date)
+                dest['endDate'] = str(date)
+                dest['visitingTime'] = str(visiting_time)
+                dest['isMurderMysteryCafe'] = False
+                current_date_destination_list.append(dest)
             # current_date_dict['destination'] = current_date_destination_list
             
             destination_average_lat_long = get_lat_long_average(current_date_destination_list)
-            distanced_accomodations_list_of_dict = get_batch_distance(destination_average_lat_long[0], destination_average_lat_long[1], accomodations_list_of_dict)
             
             if idx == date_idx_to_add_mmgc:
                 # get firestore MMG cafes
-                docs = self.firestore_db.collection(self.firestore_db_path).get()
+                with upstream_slot("firestore"):
+                    docs = self.firestore_db.collection(self.firestore_db_path).get()
                 mmgc_docs_formatted = []
                 for doc in docs:
                     doc_dict = doc.to_dict()
@@ -898,15 +1108,21 @@ class PipelineV2():
                     doc_dict['Latitude'] = float(doc_dict['geometry']['location']['lat'])
                     doc_dict['Longitude'] = float(doc_dict['geometry']['location']['lng'])
                     mmgc_docs_formatted.append(doc_dict)
-                distanced_mmgc_docs_formatted = get_batch_distance(destination_average_lat_long[0], destination_average_lat_long[1], mmgc_docs_formatted)
-                distanced_mmgc_docs_formatted = sorted(distanced_mmgc_docs_formatted, key=lambda x: x['_distance_from_target'], reverse=True)
+                # no cafes listed in firestore, leave the day as planned
+                mmgc_idx = None
+                if len(mmgc_docs_formatted) > 0:
+                    mmgc_idx = farthest_index(
+                        destination_average_lat_long[0], 
+                        destination_average_lat_long[1], 
+                        [doc_dict['Latitude'] for doc_dict in mmgc_docs_formatted], 
+                        [doc_dict['Longitude'] for doc_dict in mmgc_docs_formatted]
+                    )
                 
                 time_of_day = mmgc_visiting_times[-1]
                 new_date_destination_list = copy.deepcopy(current_date_destination_list)
                 for index, _dest in enumerate(current_date_destination_list):
-                    if time_of_day in _dest['visitingTime']:
-                        mmgc = distanced_mmgc_docs_formatted[0]
-                        mmgc.pop('_distance_from_target')
+                    if mmgc_idx is not None and time_of_day in _dest['visitingTime']:
+                        mmgc = mmgc_docs_formatted[mmgc_idx]
                         
                         id = mmgc['id']
                         dest_name = mmgc['name']
@@ -974,46 +1190,31 @@ class PipelineV2():
             
             
             # sort according to distance first, then only by preference
-            sorted_accomodations_list_of_dict = sorted(
-                distanced_accomodations_list_of_dict, 
-                key=lambda x: (x['_distance_from_target'], -x['_cosine_sim_score'])
+            selected_accomodation_idx = nearest_index(
+                destination_average_lat_long[0], 
+                destination_average_lat_long[1], 
+                accomodations_lat, 
+                accomodations_lng, 
+                scores=accomodations_scores
             )
-            selected_accomodation = sorted_accomodations_list_of_dict[0]
+            selected_accomodation = dict(accomodations_list_of_dict[selected_accomodation_idx])
             
             # remove unnecessary info from the accomodation dict
-            selected_accomodation.pop('_distance_from_target')
             selected_accomodation.pop('_cosine_sim_score')
             accom_name = selected_accomodation['Name']
             
             # now add in full details to the accomodation dict
-            # price
-            price = "Not Available"  # TODO: FIX
-            
-            # opening hours
-            if "current_opening_hours" in self.accomodations_json_data[accom_name].keys():
-                if "weekday_text" in self.accomodations_json_data[accom_name]["current_opening_hours"].keys():
-                    opening_hours = self.accomodations_json_data[accom_name]["current_opening_hours"]["weekday_text"]
-                else:
-                    opening_hours = ['Not Available']
-            else:
-                opening_hours = ['Not Available']
-            
-            # photos
-            if "photos" in self.accomodations_json_data[accom_name].keys():
-                photos = self.accomodations_json_data[accom_name]["photos"]
-            else:
-                photos = []
-            
-            # add to dict
-            selected_accomodation["Price"] = price
-            selected_accomodation["OpeningHours"] = opening_hours
-            selected_accomodation["Photos"] = photos
-            selected_accomodation["GooglePlaceID"] = self.accomodations_json_data[accom_name]['place_id']
+            accom = self.accomodations_catalog[accom_name]
+            selected_accomodation["Price"] = "Not Available"  # TODO: FIX
+            selected_accomodation["OpeningHours"] = list(accom.opening_hours)
+            selected_accomodation["Photos"] = list(accom.photos)
+            selected_accomodation["GooglePlaceID"] = accom.place_id
             
             # add accomodations and destionations to date dict
             current_date_dict['destination'] = current_date_destination_list
             current_date_dict['accomodation'] = selected_accomodation
             date_dict[str(date)] = current_date_dict
+            emit("day", {"date": str(date), "destination": current_date_destination_list, "accomodation": selected_accomodation})
             
             # save all selected accomodations for later use
             list_of_selected_accom_dicts.append(copy.deepcopy(selected_accomodation))
@@ -1074,6 +1275,7 @@ class PipelineV2():
                     accom_dict['endDate'] = dd.get('endDate')
                     trip_dict_accomodations.append(accom_dict)
         trip_dict['accomodations'] = trip_dict_accomodations
+        emit("accomodations", trip_dict['accomodations'])
 
         trip_dict_destinations = []
         for date, details in date_dict.items():
@@ -1084,11 +1286,20 @@ class PipelineV2():
 
 
         # flights
-        starting_date_obj_m1 = datetime.strptime(str(starting_date), "%Y-%m-%d") - timedelta(days=1)
-        ending_date_obj_m1 = datetime.strptime(str(ending_date), "%Y-%m-%d") + timedelta(days=1)
-        outbound_date = starting_date_obj_m1.strftime("%Y-%m-%d")
-        return_date = ending_date_obj_m1.strftime("%Y-%m-%d")
-        trip_dict["flightInfo"] = self.get_flights(user_specs=end_user_specs, query=end_user_query, outbound_date=outbound_date, return_date=return_date)
+        if llm_results["flight_search"] is not None:
+            trip_dict["flightInfo"] = llm_results["flight_search"].result()
+        else:
+            outbound_date, return_date = self.get_flight_dates(starting_date, ending_date)
+            trip_dict["flightInfo"] = self.get_flights(
+                user_specs=end_user_specs, 
+                query=end_user_query, 
+                outbound_date=outbound_date, 
+                return_date=return_date,
+                num_person=llm_results["num_person"],
+                departure_IATA=llm_results["departure_IATA"],
+                travel_class=llm_results["travel_class"]
+            )
+        emit("flightInfo", trip_dict["flightInfo"])
 
 
         trip_details_string = ""
@@ -1096,10 +1307,14 @@ class PipelineV2():
         trip_details_string += f"Trip ending date: {trip_dict['endDate']}  "
         trip_details_string += f"Tourist Spots to be visited: {', '.join([str(spot['Name']) for spot in trip_dict['destinations']])}"
 
-        title = Settings.llm.complete(generate_trip_title_prompt.format(details=trip_details_string))
-        description = Settings.llm.complete(generate_trip_description_prompt.format(name=str(title), details=trip_details_string))
+        with upstream_slot("llm"):
+            title = Settings.llm.complete(generate_trip_title_prompt.format(details=trip_details_string))
+        emit("title", str(title))
+        with upstream_slot("llm"):
+            description = Settings.llm.complete(generate_trip_description_prompt.format(name=str(title), details=trip_details_string))
 
         trip_dict['title'] = str(title)
         trip_dict['description'] = str(description)
+        emit("description", str(description))
         
         return trip_dict
\ No newline at end of file
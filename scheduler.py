@@ -0,0 +1,56 @@
+from collections import deque
+
+
+TIME_SLOTS = ['dawn', 'morning', 'noon', 'afternoon', 'evening', 'night']
+TIME_SLOT_BITS = {slot: 1 << i for i, slot in enumerate(TIME_SLOTS)}
+
+
+def time_slots_to_mask(suitable_times) -> int:
+    mask = 0
+    for slot in suitable_times:
+        mask |= TIME_SLOT_BITS.get(str(slot).strip().lower(), 0)
+    return mask
+
+
+class TimeSlotScheduler():
+    """
+    Assigns ranked items to visiting time slots. Each item's suitable times are packed into a bitmask
+    and every slot keeps a queue of the ranked indices it accepts, so taking the best remaining item
+    for a slot only skips over items already taken. Filling days x slots is near-linear in the number
+    of items and always picks the same item the old pop-and-scan loops would: the highest ranked
+    remaining item suitable for the slot.
+    """
+    def __init__(self, suitable_times_list: list):
+        # suitable_times_list is in rank order, best first
+        self.masks = [time_slots_to_mask(suitable_times) for suitable_times in suitable_times_list]
+        self.taken = [False] * len(self.masks)
+        self.queues = {
+            slot: deque(idx for idx, mask in enumerate(self.masks) if mask & bit)
+            for slot, bit in TIME_SLOT_BITS.items()
+        }
+
+
+    def take(self, slot: str):
+        # returns the index of the best remaining item for the slot, or None if there is none left
+        queue = self.queues.get(str(slot).strip().lower(), None)
+        if queue is None:
+            return None
+        while queue:
+            idx = queue.popleft()
+            if not self.taken[idx]:
+                self.taken[idx] = True
+                return idx
+        return None
+
+
+    def fill(self, num_days: int, slots: list[str]) -> list[list[tuple]]:
+        # one list of (slot, index) per day, slots without a suitable item are left out
+        schedule = []
+        for _ in range(num_days):
+            day = []
+            for slot in slots:
+                idx = self.take(slot)
+                if idx is not None:
+                    day.append((slot, idx))
+            schedule.append(day)
+        return schedule
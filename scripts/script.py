@@ -1,5 +1,13 @@
 import os
+import re
 import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from crewai import Agent, Task, Crew, Process
 from langchain_upstage import ChatUpstage
@@ -7,34 +15,84 @@ from langchain_upstage import ChatUpstage
 from crewai_tools import PDFSearchTool
 # from llama_index.llms.upstage import Upstage
 from dotenv import load_dotenv
+from upstream import upstream_slot
+from task_graph import TaskGraph
+from translation_memory import TranslationMemory
 
 load_dotenv()
 UPSTAGE_API_BASE = "https://api.upstage.ai/v1/solar"
 UPSTAGE_API_KEY = os.getenv("UPSTAGE_API_KEY")
+# crewai strips the leading "/" of task output files, so per-request workspaces must be relative paths
+SCRIPT_WORKSPACES_DIR = os.path.join("output_folder", "workspaces")
+
+
+LORE_PDF_PATH = os.path.join('scripts', 'Jeju.pdf')
+LORE_INDEX_DIR = os.path.join('db', 'lore')
+
+_lore_tools = dict()   # pdf content hash -> PDFSearchTool
+_lore_tools_lock = threading.Lock()
+
+
+def get_file_hash(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_lore_tool(pdf_path: str = LORE_PDF_PATH) -> PDFSearchTool:
+    # one PDFSearchTool per process, persisted in a chroma collection keyed by the pdf's content hash:
+    # the pdf is only chunked & embedded the first time it is seen, later processes just load the index
+    pdf_hash = get_file_hash(pdf_path)
+    with _lore_tools_lock:
+        if pdf_hash not in _lore_tools:
+            _lore_tools[pdf_hash] = PDFSearchTool(
+                pdf=pdf_path,
+                config=dict(
+                    llm=dict(
+                        provider="openai",
+                        config=dict(
+                            model="solar-1-mini-chat",
+                        ),
+                    ),
+                    embedder=dict(
+                        provider="huggingface",
+                        config=dict(
+                            model="BAAI/bge-small-en-v1.5",
+                        ),
+                    ),
+                    vectordb=dict(
+                        provider="chroma",
+                        config=dict(
+                            collection_name=f"lore_{pdf_hash[:16]}",
+                            dir=LORE_INDEX_DIR,
+                        ),
+                    ),
+                )
+            )
+        return _lore_tools[pdf_hash]
+
+
+@contextmanager
+def script_workspace():
+    # unique per-request directory for task outputs, removed afterwards so concurrent generations never collide
+    workspace = os.path.join(SCRIPT_WORKSPACES_DIR, uuid.uuid4().hex)
+    os.makedirs(workspace, exist_ok=True)
+    try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
 
 class ScriptGenerator:
-    def __init__(self, characters_num,cafe_name,cafe_environment):
+    def __init__(self, characters_num,cafe_name,cafe_environment, output_dir="output_folder"):
         self.characters_num = characters_num
         self.cafe_name= cafe_name
         self.cafe_environment = cafe_environment
+        self.output_dir = output_dir
         self.llm = ChatUpstage()
-        self.rag_tool = PDFSearchTool(
-            pdf=os.path.join('scripts', 'Jeju.pdf'),
-            config=dict(
-                llm=dict(
-                    provider="openai",
-                    config=dict(
-                        model="solar-1-mini-chat",
-                    ),
-                ),
-                embedder=dict(
-                    provider="huggingface",
-                    config=dict(
-                        model="BAAI/bge-small-en-v1.5",
-                    ),
-                ),
-            )
-        )
+        self.rag_tool = get_lore_tool()
         self.setup_agents_and_tasks()
 
     def setup_agents_and_tasks(self):
@@ -111,21 +169,23 @@ class ScriptGenerator:
             description="""Determine the background setting for the murder mystery, drawing inspiration from the legends, myths, history, and culture of Jeju Island. The storyline does not necessarily need to be set on Jeju Island. Focus on creating a rich, atmospheric setting that influences the characters' actions and motivations. The story should revolve around four key characters, each connected to these cultural and historical elements in some way.""",
             expected_output="A detailed background story inspired by Jeju Island's legends, history, and culture, including the crime scene setting, the course of the case, and key event descriptions. ",
             agent=self.script_planner,
-            output_file="output_folder/background_setting.txt"
+            output_file=os.path.join(self.output_dir, "background_setting.txt")
         )
 
         self.character_creation_task = Task(
             description="""Create complete character profiles for each character, including backstories, motivations, secrets, and relationships with other characters. Ensure that each character has a unique personality and story.""",
             expected_output="A detailed list of all characters, with each character having a complete profile, including backstories, motivations, secrets, and relationships.",
             agent=self.character_designer,
-            output_file="output_folder/character.txt"
+            context=[self.background_setting_task],
+            output_file=os.path.join(self.output_dir, "character.txt")
         )
 
         self.script_writing_task = Task(
             description=f"""Write a complete 4-day event log leading to the crime day for all the {self.characters_num} characters. Ensure each log is fully written, with no unfinished sentences or thoughts. Include specific dates, key events, thoughts, plans, and interactions that provide insight into the character's motives and actions. Each event log should conclude with a summary or reflective thought that naturally completes the narrative.""",
             expected_output="A complete 4-day event log for each character. Write for all characters",
             agent=self.script_writer_agent,
-            output_file="output_folder/character_event_log.txt"
+            context=[self.background_setting_task, self.character_creation_task],
+            output_file=os.path.join(self.output_dir, "character_event_log.txt")
         )
 
         self.player_writing_instruction_task = Task(
@@ -134,29 +194,51 @@ class ScriptGenerator:
             Create a guide and explanation on how to roleplay each character in these rounds. For each character, write the character's name followed by the detailed instructions for each round of discussion for that character. Don't expose the murderer. Put all the instructions for each character together in a clear and organized format.""",
             expected_output="A list of guide and explanation on what the players have to do to roleplay their characters, titled with the character's name followed by detailed instructions for each round. Ensure that each character's instructions are presented together and clearly labeled. Make it more personal for each character.",
             agent=self.player_writer_agent,
-            output_file="output_folder/player_instructions.txt"
+            context=[self.background_setting_task, self.character_creation_task, self.script_writing_task],
+            output_file=os.path.join(self.output_dir, "player_instructions.txt")
         )
 
         self.clue_design_task = Task(
             description="""Design 4 clues that players discover in the game, ensuring that these clues are challenging and fit the plot logic. Each character should have 2 key clues and 2 misleading clues. Title each section with the character's name followed by the list of their clues and misleading clues.""",
             expected_output="A list of 4 clues for each character, including 2 key clues and 2 misleading clues, with explanations of their role in the story. Ensure each character's section is titled with the character's name, and the clues are clearly labeled as key clues or misleading clues.",
             agent=self.clue_generator,
-            output_file="output_folder/player_clues.txt"
+            context=[self.background_setting_task, self.character_creation_task, self.script_writing_task],
+            output_file=os.path.join(self.output_dir, "player_clues.txt")
         )
         self.title = Task(
             description="""Write the title for the script generated.""",
             expected_output="Output a title",
             agent=self.titler,
-            output_file="output_folder/title.txt"
+            context=[self.background_setting_task],
+            output_file=os.path.join(self.output_dir, "title.txt")
         )
         self.time = Task(
             description="""Write the game duraction""",
             expected_output=" Just right the answer as '2-3hours'. Don't write full sentences, just a direct duration",
             agent=self.timer,
-            output_file="output_folder/time_taken.txt"
+            output_file=os.path.join(self.output_dir, "time_taken.txt")
         )
 
-    def run_tasks(self):
+    def run_task_graph(self, crew):
+        # runs every task as soon as the tasks in its context are done, so independent tasks
+        # (e.g. title & duration, clues & player instructions) overlap instead of queueing
+        for agent in crew.agents:
+            agent.crew = crew
+        task_names = {id(task): f"task_{idx}" for idx, task in enumerate(crew.tasks)}
+
+        def make_runner(task):
+            def run(**context_outputs):
+                context = "\n\n----------\n\n".join(str(output) for output in context_outputs.values())
+                return task.execute_sync(agent=task.agent, context=context)
+            return run
+
+        graph = TaskGraph(max_workers=len(crew.tasks))
+        for task in crew.tasks:
+            graph.add(task_names[id(task)], make_runner(task), [task_names[id(dep)] for dep in (task.context or [])])
+        return graph.run()
+
+
+    def run_tasks(self, parallel=True):
         crew = Crew(
             agents=[self.script_planner, self.character_designer, self.script_writer_agent, self.clue_generator, self.player_writer_agent, self.titler,self.timer],
             tasks=[self.background_setting_task, self.character_creation_task, self.script_writing_task, self.clue_design_task, self.player_writing_instruction_task, self.title,self.time],
@@ -164,7 +246,10 @@ class ScriptGenerator:
             process=Process.sequential
         )
 
-        crew.kickoff()
+        if parallel:
+            self.run_task_graph(crew)
+        else:
+            crew.kickoff()
         task_outputs = {}
 
         for task in crew.tasks:
@@ -177,7 +262,7 @@ class ScriptGenerator:
             except Exception as e:
                 print(f"Error reading file for {task.agent.role}: {e}")
 
-        output_directory = "output_folder"  # Change this to your desired folder name
+        output_directory = self.output_dir
         os.makedirs(output_directory, exist_ok=True)  # Create the directory if it doesn't exist
 
         # Specify the path for output.json
@@ -187,6 +272,7 @@ class ScriptGenerator:
             json.dump(task_outputs, json_file, indent=5)
         
         print("All task outputs have been saved to:", output_json_path)
+        self.task_outputs = task_outputs
 
         return output_json_path, self.cafe_name
 
@@ -196,61 +282,117 @@ import json
 
 class Translator:
     
-    def __init__(self):
+    def __init__(self, max_workers=8, max_retries=3, retry_backoff=1.0, translation_memory: TranslationMemory = None):
         self.client = OpenAI(api_key=UPSTAGE_API_KEY, base_url=UPSTAGE_API_BASE)
+        self.translation_memory = translation_memory
+        self.max_workers = max_workers    # max chunks in flight across all sections
+        self.max_retries = max_retries    # per chunk
+        self.retry_backoff = retry_backoff    # secs, doubled after every failed attempt
 
-    def translate_text(self, text, model="solar-1-mini-translate-enko", chunk_size=1600):
-        # Split the text into chunks, making sure not to split in the middle of a sentence
-        import re
-        
+    @staticmethod
+    def split_text(text, chunk_size):
         # Split text into chunks, trying to avoid splitting sentences
-        def split_text(text, chunk_size):
-            sentences = re.split(r'(?<=[.!?]) +', text)
-            chunks, current_chunk = [], ""
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) + 1 <= chunk_size:
-                    if current_chunk:
-                        current_chunk += " " + sentence
-                    else:
-                        current_chunk = sentence
+        sentences = re.split(r'(?<=[.!?]) +', text)
+        chunks, current_chunk = [], ""
+        for sentence in sentences:
+            if len(current_chunk) + len(sentence) + 1 <= chunk_size:
+                if current_chunk:
+                    current_chunk += " " + sentence
                 else:
-                    chunks.append(current_chunk)
                     current_chunk = sentence
-            if current_chunk:
+            else:
                 chunks.append(current_chunk)
-            return chunks
-
-        chunks = split_text(text, chunk_size)
-        translated_text = ""
-
-        for chunk in chunks:
-            stream = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {
-                        "role": "assistant",
-                        "content": chunk
-                    }
-                ],
-                stream=True,
-            )
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    translated_text += chunk.choices[0].delta.content
+                current_chunk = sentence
+        if current_chunk:
+            chunks.append(current_chunk)
+        return chunks
+
+    def translate_chunk(self, chunk, model="solar-1-mini-translate-enko"):
+        if not chunk.strip():
+            return chunk
+        for attempt in range(self.max_retries):
+            try:
+                translated_chunk = ""
+                with upstream_slot("translation"):
+                    stream = self.client.chat.completions.create(
+                        model=model,
+                        messages=[
+                            {
+                                "role": "assistant",
+                                "content": chunk
+                            }
+                        ],
+                        stream=True,
+                    )
+                    for part in stream:
+                        if part.choices[0].delta.content:
+                            translated_chunk += part.choices[0].delta.content
+                return translated_chunk
+            except Exception as e:
+                print(f"[Translator] Chunk translation failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+    def split_segments(self, text, chunk_size):
+        # paragraphs first, so segment boundaries (and translation memory keys) stay stable between scripts,
+        # then sentence-aligned chunks within long paragraphs; returns (is_text, piece) pairs
+        pieces = []
+        for part in re.split(r'(\n+)', text):
+            if not part.strip():
+                if part:
+                    pieces.append((False, part))
+                continue
+            chunks = [chunk for chunk in self.split_text(part, chunk_size) if chunk.strip()]
+            for idx, chunk in enumerate(chunks):
+                if idx > 0:
+                    pieces.append((False, " "))
+                pieces.append((True, chunk))
+        return pieces
+
+    def translate_sections(self, sections: list, model="solar-1-mini-translate-enko", chunk_size=1600) -> list:
+        # translates the segments of every section concurrently, then reassembles each section in order.
+        # segments already in the translation memory (or repeated within the request) are not sent upstream
+        segmented_sections = [self.split_segments(text, chunk_size) for text in sections]
+
+        translations, pending = {}, []
+        for pieces in segmented_sections:
+            for is_text, piece in pieces:
+                if not is_text or piece in translations:
+                    continue
+                cached = self.translation_memory.get(piece, model) if self.translation_memory is not None else None
+                translations[piece] = cached
+                if cached is None:
+                    pending.append(piece)
+        print(f"[Translator] {len(translations) - len(pending)}/{len(translations)} segments from translation memory")
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            translated_pending = list(executor.map(lambda segment: self.translate_chunk(segment, model=model), pending))
+        for segment, translated_segment in zip(pending, translated_pending):
+            translations[segment] = translated_segment
+            if self.translation_memory is not None:
+                self.translation_memory.set(segment, model, translated_segment)
+
+        return ["".join(translations[piece] if is_text else piece for is_text, piece in pieces) for pieces in segmented_sections]
+
+    def translate_text(self, text, model="solar-1-mini-translate-enko", chunk_size=1600):
+        return self.translate_sections([text], model=model, chunk_size=chunk_size)[0]
+
 
-        return translated_text
+    def translate_dict(self, data: dict) -> dict:
+        print(f"Translating {', '.join(data.keys())}...")
+        translated_texts = self.translate_sections(list(data.values()))
+        translated_data = dict(zip(data.keys(), translated_texts))
+        for key, translated_text in translated_data.items():
+            print(f"{key}: {translated_text}")
+        return translated_data
 
 
     def translate_and_save(self, input_file, output_file):
         with open(input_file, 'r', encoding='utf-8') as file:
             data = json.load(file)
 
-        translated_data = {}
-        for key, text in data.items():
-            print(f"Translating {key}...")
-            translated_text = self.translate_text(text)
-            print(translated_text)
-            translated_data[key] = translated_text
+        translated_data = self.translate_dict(data)
 
         with open(output_file, 'w', encoding='utf-8') as file:
             json.dump(translated_data, file, ensure_ascii=False, indent=4)
@@ -1,17 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
 import json
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, firestore
 from llama_index.core import Settings
 from llama_index.llms.upstage import Upstage
 from llama_index.embeddings.upstage import UpstageEmbedding
-from image_generator import add_images_to_script, get_place_img
-from scripts.script import ScriptGenerator, Translator
+from image_generator import generate_script_decoration, apply_script_decoration, add_images_to_scripts, get_place_img
+from scripts.script import ScriptGenerator, Translator, script_workspace, get_lore_tool
 from utils import extract_photo_reference, read_file
+from llm_cache import LLMResponseCache
+from flight_cache import FlightSearchCache
+from flight_warmer import FareCacheWarmer
+from jobs import JobManager
+from translation_memory import TranslationMemory
 
 
 
@@ -29,6 +37,26 @@ firebase_admin.initialize_app(cred)
 db = firestore.client()
 
 
+llm_cache = LLMResponseCache(
+    db_path       = os.path.join('cache', 'llm_responses.db'),
+    max_entries   = 10000,
+    default_ttl   = 24 * 60 * 60,
+    template_ttls = {
+        # preference descriptions are generative, refresh them more often
+        "generate_accomodation_preference_prompt": 60 * 60,
+        "generate_tourist_attraction_preference_prompt": 60 * 60,
+        # airports do not move
+        "departure_airport_IATA_extraction": 30 * 24 * 60 * 60,
+    }
+)
+
+# google_flights results, fares change quickly so entries only live for FLIGHT_CACHE_TTL secs
+flight_cache = FlightSearchCache(
+    db_path     = os.path.join('cache', 'flights.db'),
+    ttl         = float(os.getenv('FLIGHT_CACHE_TTL', 30 * 60)),
+    max_entries = 5000
+)
+
 from pipelinev2 import PipelineV2
 pipeline = PipelineV2(
     embed_model_size         = 4096,
@@ -42,7 +70,39 @@ pipeline = PipelineV2(
     restaurants_json         = os.path.join('locations', 'detailed', 'restaurants_detailed.json'),
     tourist_spots_json       = os.path.join('locations', 'detailed', 'tourist_spots_detailed.json'),
     firestore_db             = db,
-    firestore_db_path        = 'script_restaurant'
+    firestore_db_path        = 'script_restaurant',
+    llm_cache                = llm_cache,
+    flight_cache             = flight_cache,
+    retrieval_similarity_threshold = 0.97
+)
+
+# refreshes popular routes into the flight cache off the request path, FLIGHT_WARMER_BUDGET=0 to disable.
+# the daily budget is kept in cache/flights.db, so it holds across restarts and worker processes
+fare_cache_warmer = FareCacheWarmer(
+    pipeline      = pipeline,
+    flight_cache  = flight_cache,
+    interval      = float(os.getenv('FLIGHT_WARMER_INTERVAL', flight_cache.ttl)),
+    budget        = int(os.getenv('FLIGHT_WARMER_BUDGET', 40)),
+    daily_budget  = int(os.getenv('FLIGHT_WARMER_DAILY_BUDGET', 160)),
+    initial_delay = float(os.getenv('FLIGHT_WARMER_INITIAL_DELAY', 10 * 60)),
+    num_origins   = 3,
+    horizon_days  = 14
+).start()
+
+# translated script segments, shared by every /generate_script request
+translation_memory = TranslationMemory(
+    db_path     = os.path.join('cache', 'translation_memory.db'),
+    max_entries = 50000
+)
+
+# build (or load) the Jeju lore index once at startup instead of inside the first /generate_script
+get_lore_tool()
+
+# background generations, polled via /jobs/<job_id>
+jobs = JobManager(
+    max_workers = int(os.getenv("JOB_MAX_WORKERS", 4)),
+    result_ttl  = float(os.getenv("JOB_RESULT_TTL", 60 * 60)),
+    db_path     = os.path.join('cache', 'jobs.db')
 )
 
 @app.route('/')
@@ -50,20 +110,13 @@ def home():
     return 'Hello World'
 
 
-@app.route('/check_init_input', methods=['POST'])
-def check_init_input():
-    query = request.form.get('query')
+def run_check_init_input(query):
     print("check_init_input: ", query)
-    check_result_dict = pipeline.check_query_detail(query=str(query))
-    return jsonify(check_result_dict)
+    return pipeline.check_query_detail(query=str(query))
 
 
-@app.route('/generate_trip', methods=['POST'])
-def generate_trip():
-    user_query = request.form.get('query')
-    user_properties = request.form.get('user_props')
-    mode = request.form.get('mode')  # test
-    
+def run_generate_trip(user_query, user_properties, mode, progress=None):
+    progress = progress or (lambda message: None)
     print("generate_trip: ", user_query, user_properties)
     print(str(mode).lower().strip())
     
@@ -73,67 +126,216 @@ def generate_trip():
             trip_dict = trip_dict["data"]
     else:
         start_time = time.time()
+        progress("planning trip")
         trip_dict = pipeline.generate_trip(
             end_user_specs=str(user_properties), 
             end_user_query=str(user_query)
         )
+        progress("fetching thumbnail")
         trip_dict['thumbnail'] = get_place_img(trip_dict['title'])
         print(f"[Generate Trip took {time.time() - start_time} secs]")
     flattened_trip_dict = extract_photo_reference(trip_dict)
-    return jsonify({'data': flattened_trip_dict})
+    return {'data': flattened_trip_dict}
 
 
-@app.route('/generate_script', methods=['POST'])
-def generate_script():
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_generate_trip(user_query, user_properties, mode, on_finish=None):
+    # starts the pipeline right away and returns a generator of server-sent events, one per finished
+    # pipeline stage, then a final "done" event with the full trip. on_finish() is called from the
+    # pipeline thread once it is over, even if the client stops reading
+    print("generate_trip (stream): ", user_query, user_properties)
+    events = queue.Queue()
+
+    def on_stage(stage, payload):
+        # snapshot now, the pipeline keeps mutating these dicts
+        payload = json.loads(json.dumps(payload, ensure_ascii=False, default=str))
+        if stage in ["destinations", "accomodations"]:
+            payload = extract_photo_reference({stage: payload})[stage]
+        elif stage == "day":
+            payload["destination"] = extract_photo_reference({"destinations": payload["destination"]})["destinations"]
+            payload["accomodation"] = extract_photo_reference({"accomodations": [payload["accomodation"]]})["accomodations"][0]
+        events.put((stage, payload))
+
+    def run():
+        try:
+            if "test" in str(mode).lower().strip():
+                events.put(("done", run_generate_trip(user_query, user_properties, mode)))
+                return
+            start_time = time.time()
+            trip_dict = pipeline.generate_trip(
+                end_user_specs=str(user_properties), 
+                end_user_query=str(user_query),
+                on_stage=on_stage
+            )
+            trip_dict['thumbnail'] = get_place_img(trip_dict['title'])
+            print(f"[Generate Trip (stream) took {time.time() - start_time} secs]")
+            events.put(("done", {'data': extract_photo_reference(trip_dict)}))
+        except Exception as e:
+            print(f"[Generate Trip (stream)] Error: {e}")
+            events.put(("error", {"error": f"Error generating trip: {e}"}))
+        finally:
+            if on_finish is not None:
+                on_finish()
+
+    def iter_events():
+        while True:
+            stage, payload = events.get()
+            yield format_sse(stage, payload)
+            if stage in ["done", "error"]:
+                return
+
+    threading.Thread(target=run, daemon=True).start()
+    return iter_events()
+
+
+def run_generate_script(mode, characters_num, cafe_name, cafe_environment, progress=None):
+    # returns (response dict, http status)
+    progress = progress or (lambda message: None)
     try:
         start_time = time.time()
-        # Get the JSON data from the request
-        
-        # test mode
-        mode = request.form.get('mode')  # test
         
         if "test" not in str(mode).lower().strip():
-            # Extract the required fields from the JSON body
-            characters_num = request.form.get('characters_num')
-            cafe_name = request.form.get('cafe_name')
-            cafe_environment = request.form.get('cafe_environment')
-
             # check for missing fields
             if not characters_num or not cafe_name or not cafe_environment:
-                return jsonify({"error": "Missing required fields"}), 400
-
-            # init script generator
-            script_generator = ScriptGenerator(
-                characters_num=characters_num,
-                cafe_name=cafe_name,
-                cafe_environment=cafe_environment
-            )
+                return {"error": "Missing required fields"}, 400
 
-            # run tasks and generate script
-            output_json_path, cafe_name = script_generator.run_tasks()
+            # each request gets its own workspace, so script generations can run in parallel
+            with script_workspace() as workspace:
+                # init script generator
+                progress("generating script")
+                script_generator = ScriptGenerator(
+                    characters_num=characters_num,
+                    cafe_name=cafe_name,
+                    cafe_environment=cafe_environment,
+                    output_dir=workspace
+                )
 
+                # run tasks and generate script
+                output_json_path, cafe_name = script_generator.run_tasks()
+                eng_script = read_file(output_json_path, "json")
 
-            input_directory = "output_folder"
-            input_file_path = os.path.join(input_directory, "script.json")
-            output_file_path = os.path.join(input_directory, "translated_output.json")
-
-            # translation
-            translator = Translator()
-            translator.translate_and_save(input_file_path, output_file_path)
+            # translation runs while the english script is chunked and decorated with images,
+            # the same chunks and images are then mapped onto the translated script
+            progress("translating script and adding images")
+            translator = Translator(translation_memory=translation_memory)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                kor_future = executor.submit(translator.translate_dict, eng_script)
+                decoration = generate_script_decoration(eng_script)
+                kor_script = kor_future.result()
+            eng_script, kor_script = apply_script_decoration(decoration, eng_script, kor_script)
             print(f"[Generate Script took {time.time() - start_time} secs]")
 
-            return jsonify({
-                "eng_script": add_images_to_script(read_file(output_json_path, "json")),
-                "kor_script": add_images_to_script(read_file(output_file_path, "json")),
-            })
+            return {
+                "eng_script": eng_script,
+                "kor_script": kor_script,
+            }, 200
 
         else:
-            return jsonify({
-                "eng_script": add_images_to_script(read_file("output_folder/script.json", "json")),
-                "kor_script": add_images_to_script(read_file("output_folder/translated_output.json", "json")),
-            })
+            eng_script, kor_script = add_images_to_scripts(
+                read_file("output_folder/script.json", "json"),
+                read_file("output_folder/translated_output.json", "json")
+            )
+            return {
+                "eng_script": eng_script,
+                "kor_script": kor_script,
+            }, 200
     except Exception as e:
-        return jsonify({"error": f"Error generating script: {e}"})
+        return {"error": f"Error generating script: {e}"}, 200
+
+
+@app.route('/check_init_input', methods=['POST'])
+def check_init_input():
+    query = request.form.get('query')
+    check_result_dict = run_check_init_input(query)
+    return jsonify(check_result_dict)
+
+
+@app.route('/generate_trip', methods=['POST'])
+def generate_trip():
+    user_query = request.form.get('query')
+    user_properties = request.form.get('user_props')
+    mode = request.form.get('mode')  # test
+    return jsonify(run_generate_trip(user_query, user_properties, mode))
+
+
+@app.route('/generate_trip/stream', methods=['POST'])
+def generate_trip_stream():
+    user_query = request.form.get('query')
+    user_properties = request.form.get('user_props')
+    mode = request.form.get('mode')  # test
+    return Response(
+        stream_with_context(stream_generate_trip(user_query, user_properties, mode)), 
+        mimetype='text/event-stream', 
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/generate_script', methods=['POST'])
+def generate_script():
+    # test mode
+    mode = request.form.get('mode')  # test
+    
+    # Extract the required fields from the JSON body
+    characters_num = request.form.get('characters_num')
+    cafe_name = request.form.get('cafe_name')
+    cafe_environment = request.form.get('cafe_environment')
+    
+    response, status = run_generate_script(mode, characters_num, cafe_name, cafe_environment)
+    return jsonify(response), status
+
+
+
+def run_generate_script_job(mode, characters_num, cafe_name, cafe_environment, progress=None):
+    response, status = run_generate_script(mode, characters_num, cafe_name, cafe_environment, progress=progress)
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+
+def submit_generate_trip_job(user_query, user_properties, mode):
+    job_id = jobs.submit("generate_trip", run_generate_trip, user_query, user_properties, mode)
+    return {"jobId": job_id}, 202
+
+
+def submit_generate_script_job(mode, characters_num, cafe_name, cafe_environment):
+    if "test" not in str(mode).lower().strip():
+        if not characters_num or not cafe_name or not cafe_environment:
+            return {"error": "Missing required fields"}, 400
+    job_id = jobs.submit("generate_script", run_generate_script_job, mode, characters_num, cafe_name, cafe_environment)
+    return {"jobId": job_id}, 202
+
+
+def get_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found or expired"}, 404
+    return job, 200
+
+
+@app.route('/jobs/generate_trip', methods=['POST'])
+def generate_trip_job():
+    response, status = submit_generate_trip_job(request.form.get('query'), request.form.get('user_props'), request.form.get('mode'))
+    return jsonify(response), status
+
+
+@app.route('/jobs/generate_script', methods=['POST'])
+def generate_script_job():
+    response, status = submit_generate_script_job(
+        request.form.get('mode'), 
+        request.form.get('characters_num'), 
+        request.form.get('cafe_name'), 
+        request.form.get('cafe_environment')
+    )
+    return jsonify(response), status
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    response, status = get_job_status(job_id)
+    return jsonify(response), status
 
 
 
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class TaskGraph():
+    """
+    Runs a set of named callables respecting their dependencies. Tasks whose dependencies have all
+    finished are submitted to a thread pool straight away, so independent (I/O bound) calls such as
+    LLM completions overlap instead of running one after another. With max_workers=1 the graph
+    degrades to a plain sequential run in dependency order.
+    """
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max(1, int(max_workers))
+        self.tasks = dict()   # name -> (fn, deps)
+
+
+    def add(self, name: str, fn, deps: list[str] = None):
+        # fn is called with the results of its dependencies as keyword arguments
+        if name in self.tasks:
+            raise ValueError(f"[TaskGraph] Duplicate task: {name}")
+        self.tasks[name] = (fn, list(deps or []))
+        return self
+
+
+    def _check(self):
+        for name, (_, deps) in self.tasks.items():
+            for dep in deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"[TaskGraph] Task '{name}' depends on unknown task '{dep}'")
+        # cycle detection (kahn)
+        indegree = {name: len(deps) for name, (_, deps) in self.tasks.items()}
+        ready = [name for name, d in indegree.items() if d == 0]
+        visited = 0
+        while ready:
+            current = ready.pop()
+            visited += 1
+            for name, (_, deps) in self.tasks.items():
+                if current in deps:
+                    indegree[name] -= 1
+                    if indegree[name] == 0:
+                        ready.append(name)
+        if visited != len(self.tasks):
+            raise ValueError("[TaskGraph] Dependency cycle detected")
+
+
+    def run(self) -> dict:
+        self._check()
+        results = dict()
+        pending = dict(self.tasks)
+
+        def ready_tasks():
+            return [name for name, (_, deps) in pending.items() if all(dep in results for dep in deps)]
+
+        if self.max_workers == 1:
+            while pending:
+                for name in ready_tasks():
+                    fn, deps = pending.pop(name)
+                    results[name] = fn(**{dep: results[dep] for dep in deps})
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = dict()   # future -> name
+            while pending or running:
+                for name in ready_tasks():
+                    fn, deps = pending.pop(name)
+                    running[executor.submit(fn, **{dep: results[dep] for dep in deps})] = name
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        # nothing downstream can run anymore, drop whatever has not started yet
+                        for f in running:
+                            f.cancel()
+                        raise
+        return results
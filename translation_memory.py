@@ -0,0 +1,88 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_TRANSLATION_MEMORY_DB = os.path.join('cache', 'translation_memory.db')
+
+
+def normalize_segment(text: str) -> str:
+    return re.sub(r'\s+', ' ', str(text)).strip()
+
+
+class TranslationMemory():
+    """
+    Persistent translation memory backed by a local SQLite file. Translated segments are keyed by
+    sha256(model name + normalized source segment) and evicted least-recently-used once max_entries
+    is exceeded, so only segments never seen before are sent to the translation API.
+    """
+    def __init__(self, db_path: str = DEFAULT_TRANSLATION_MEMORY_DB, max_entries: int = 50000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                translation TEXT,
+                last_access REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translation_memory_last_access ON translation_memory (last_access)")
+        self._conn.commit()
+
+
+    @staticmethod
+    def make_key(segment: str, model: str) -> str:
+        return hashlib.sha256("\x00".join([str(model), normalize_segment(segment)]).encode('utf-8')).hexdigest()
+
+
+    def get(self, segment: str, model: str):
+        key = self.make_key(segment, model)
+        with self._lock:
+            row = self._conn.execute("SELECT translation FROM translation_memory WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE translation_memory SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+
+    def set(self, segment: str, model: str, translation: str):
+        key = self.make_key(segment, model)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translation_memory (key, model, translation, last_access) VALUES (?, ?, ?, ?)",
+                (key, model, translation, time.time())
+            )
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM translation_memory").fetchone()[0]
+            if num_entries > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM translation_memory WHERE key IN (SELECT key FROM translation_memory ORDER BY last_access ASC LIMIT ?)",
+                    (num_entries - self.max_entries,)
+                )
+            self._conn.commit()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            num_entries = self._conn.execute("SELECT COUNT(*) FROM translation_memory").fetchone()[0]
+        return {
+            "entries": num_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / (self.hits + self.misses) if (self.hits + self.misses) > 0 else 0.
+        }
@@ -0,0 +1,38 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+# max number of in-flight calls per upstream service for the whole process, override with e.g. UPSTREAM_LIMIT_SERPAPI=2
+DEFAULT_UPSTREAM_LIMITS = {
+    "llm": 16,
+    "embedding": 16,
+    "serpapi": 4,
+    "firestore": 8,
+    "pexels": 8,
+    "translation": 8,
+}
+
+_semaphores = dict()
+_semaphores_lock = threading.Lock()
+
+
+def get_upstream_limit(name: str) -> int:
+    return int(os.getenv(f"UPSTREAM_LIMIT_{name.upper()}", DEFAULT_UPSTREAM_LIMITS.get(name, 8)))
+
+
+def configure_upstream_limits(**limits):
+    # e.g. configure_upstream_limits(llm=32, serpapi=2), must be called before the first request
+    with _semaphores_lock:
+        for name, limit in limits.items():
+            _semaphores[name] = threading.BoundedSemaphore(max(1, int(limit)))
+
+
+@contextmanager
+def upstream_slot(name: str):
+    with _semaphores_lock:
+        if name not in _semaphores:
+            _semaphores[name] = threading.BoundedSemaphore(max(1, get_upstream_limit(name)))
+        semaphore = _semaphores[name]
+    with semaphore:
+        yield
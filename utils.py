@@ -3,6 +3,7 @@ import os
 import re
 from llama_index.llms.upstage import Upstage
 from llama_index.core.llms import ChatMessage
+from upstream import upstream_slot
 
 def read_file(file_path: str, file_type: str):
     if file_type == "json":
@@ -26,9 +27,10 @@ def parse_output(output: str, fields: list[str]) -> dict:
 def generate_upstage_response(input: str):
     llm = Upstage(api_key=os.getenv('UPSTAGE_API_KEY'))
  
-    response = llm.complete(
-        prompt=input,
-    )
+    with upstream_slot("llm"):
+        response = llm.complete(
+            prompt=input,
+        )
     
     return str(response)
 